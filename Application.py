@@ -1,7 +1,7 @@
 import curses
 import traceback
 from collections import defaultdict, namedtuple
-from concurrent.futures import Future
+from concurrent.futures import Future, CancelledError
 from enum import Enum
 from queue import Queue
 from loguru import logger
@@ -177,6 +177,9 @@ class Application:
         def inner_function(*args, **kwargs):
             try:
                 return function(*args, **kwargs)
+            except CancelledError:
+                # Cancelled work isn't an error
+                raise
             except Exception as e:
                 self.event_queue.put(ExceptionOccured(exception=e))
 
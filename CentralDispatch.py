@@ -1,8 +1,12 @@
+import heapq
+import itertools
+import multiprocessing
 import threading
+import time
 import traceback
-from concurrent.futures import Future
+from concurrent.futures import Future, CancelledError
+from concurrent.futures.process import ProcessPoolExecutor
 from concurrent.futures.thread import ThreadPoolExecutor
-from queue import Queue, Empty
 import functools
 from loguru import logger
 
@@ -19,15 +23,9 @@ def perform_on(func, dispatch_queue, do_async=False):
     return inner_function
 
 
-def wait_on_futures(futures_queue: Queue):
-    try:
-        future = futures_queue.get_nowait()
-
-        while True:
-            _ = future.result()
-            future = futures_queue.get_nowait()
-    except Empty:
-        return
+def cancel_futures(futures: [Future]):
+    for future in futures:
+        future.cancel()
 
 
 def wrap_with_try(func):
@@ -35,6 +33,9 @@ def wrap_with_try(func):
     def inner_function(*args, **kwargs):
         try:
             return func(*args, **kwargs)
+        except CancelledError:
+            # Cancelled work isn't an error
+            raise
         except Exception as e:
             logger.error(f"Error: {e}")
             logger.error(traceback.format_exc())
@@ -43,22 +44,221 @@ def wrap_with_try(func):
     return inner_function
 
 
+class TaskCancelled(CancelledError):
+    """Raised by a task that stops part way because its cancellation token was cancelled"""
+
+
+class CancellationToken:
+    """
+        Shared by the tasks of one piece of work, which check cancelled as they go,
+        between directory entries for example, and stop once it's set
+    """
+    def __init__(self):
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+    def raise_if_cancelled(self):
+        if self.cancelled:
+            raise TaskCancelled()
+
+
+class ProcessCancellationToken(CancellationToken):
+    """
+        The cancellation token of a ProcessDispatchQueue, backed by an event its
+        worker processes share. Handed to a task as an argument, it becomes the
+        worker's own token, so cancelling the queue also stops running tasks
+    """
+    def __init__(self, event):
+        self.event = event
+
+    @property
+    def cancelled(self) -> bool:
+        return self.event.is_set()
+
+    def cancel(self):
+        self.event.set()
+
+    # Events can only be shared when a process starts, a task gets the token its worker started with
+    def __reduce__(self):
+        return worker_cancel_token, ()
+
+
+_worker_cancel_token = None
+
+
+def _start_process_worker(event):
+    global _worker_cancel_token
+    _worker_cancel_token = ProcessCancellationToken(event)
+
+
+def worker_cancel_token() -> CancellationToken:
+    """The token of the ProcessDispatchQueue this worker process belongs to"""
+    if _worker_cancel_token is None:
+        return CancellationToken()
+
+    return _worker_cancel_token
+
+
+class TrackedTask:
+    """What a task group knows about one of its tasks, it's forgotten once the task is done"""
+    __slots__ = ["token", "started"]
+
+    def __init__(self, token: CancellationToken):
+        self.token = token
+        self.started = False
+
+
+class TaskGroup:
+    """
+        Counts the tasks submitted to it that haven't finished, so waiting on them
+        doesn't mean holding on to every future until the end. Tasks can add more
+        tasks while the group is waited on, they're added before the task that
+        submits them finishes, so the count can't reach zero early
+        With max_pending, adding blocks while that many are unfinished, which
+        holds producers back instead of letting queued work pile up. Threads
+        running one of the group's own tasks are never held back, they'd be
+        waiting on themselves
+        cancel drops every tracked task that hasn't started yet in one go, they're
+        skipped if they're ever reached, and waiting only waits on running ones
+    """
+    def __init__(self, max_pending=None):
+        self.max_pending = max_pending
+        self.condition = threading.Condition()
+        self.pending = 0
+        # Tracked tasks that haven't started, all of them are dropped by cancel
+        self.waiting = 0
+        self.token = CancellationToken()
+        self.exception = None
+        self.running_tasks = threading.local()
+        # Futures handed out by finished, resolved when the count next reaches zero
+        self.waiters = []
+
+    def add(self):
+        with self.condition:
+            if self.max_pending is not None and getattr(self.running_tasks, "depth", 0) == 0:
+                while self.pending >= self.max_pending:
+                    self.condition.wait()
+
+            self.pending += 1
+
+    def done(self, future: Future = None):
+        """Counts off a task, keeping the first exception raised by one to be raised by wait"""
+        with self.condition:
+            self._count_done(future)
+
+        self._resolve_waiters()
+
+    def _count_done(self, future: Future):
+        if future is not None and self.exception is None and not future.cancelled():
+            exception = future.exception()
+            if not isinstance(exception, CancelledError):
+                self.exception = exception
+
+        self.pending -= 1
+        self.condition.notify_all()
+
+    def track(self, submit, task, *args, **kwargs) -> Future:
+        """Adds a task and submits it with submit, which returns its future"""
+        self.add()
+
+        with self.condition:
+            tracked_task = TrackedTask(self.token)
+            self.waiting += 1
+
+        try:
+            future = submit(self.wrap(task, tracked_task), *args, **kwargs)
+        except BaseException:
+            self._tracked_done(tracked_task, None)
+            raise
+
+        future.add_done_callback(functools.partial(self._tracked_done, tracked_task))
+        return future
+
+    def _tracked_done(self, tracked_task: TrackedTask, future: Future):
+        with self.condition:
+            # Dropped by cancel before it started, it's already been counted off
+            if tracked_task.token.cancelled and not tracked_task.started:
+                return
+
+            if not tracked_task.started:
+                self.waiting -= 1
+            self._count_done(future)
+
+        self._resolve_waiters()
+
+    def wrap(self, task, tracked_task: TrackedTask = None):
+        @functools.wraps(task)
+        def inner_function(*args, **kwargs):
+            if tracked_task is not None:
+                with self.condition:
+                    if tracked_task.token.cancelled:
+                        raise TaskCancelled()
+
+                    tracked_task.started = True
+                    self.waiting -= 1
+
+            self.running_tasks.depth = getattr(self.running_tasks, "depth", 0) + 1
+            try:
+                return task(*args, **kwargs)
+            finally:
+                self.running_tasks.depth -= 1
+
+        return inner_function
+
+    def cancel(self):
+        """Drops the tasks that haven't started, those that have are left to finish"""
+        with self.condition:
+            self.token.cancel()
+            self.token = CancellationToken()
+            self.pending -= self.waiting
+            self.waiting = 0
+            self.condition.notify_all()
+
+        self._resolve_waiters()
+
+    def finished(self) -> Future:
+        """A future that's done once every task is finished, raising the first exception one raised"""
+        future = Future()
+
+        with self.condition:
+            self.waiters.append(future)
+
+        self._resolve_waiters()
+        return future
+
+    def wait(self):
+        self.finished().result()
+
+    def _resolve_waiters(self):
+        with self.condition:
+            if self.pending > 0 or len(self.waiters) == 0:
+                return
+
+            waiters, self.waiters = self.waiters, []
+            exception, self.exception = self.exception, None
+
+        for waiter in waiters:
+            if exception is not None:
+                waiter.set_exception(exception)
+            else:
+                waiter.set_result(None)
+
+
 class AppShutDownSignal: pass
 
 
 class SerialDispatchQueue:
-    def __init__(self, exception_handler):
+    def __init__(self, exception_handler, max_pending=None):
         self.exception_handler = exception_handler
         self.task_threadpool = ThreadPoolExecutor(1)
-        self.futures_queue = Queue()
+        self.task_group = TaskGroup(max_pending)
 
     def submit_async(self, block, *args, **kwargs) -> Future:
         task = self.exception_handler(block)
 
-        future = self.task_threadpool.submit(task, *args, **kwargs)
-        self.futures_queue.put(future)
-
-        return future
+        return self.task_group.track(self.task_threadpool.submit, task, *args, **kwargs)
 
     def await_result(self, block, *args, **kwargs):
         future = self.submit_async(block, *args, **kwargs)
@@ -66,60 +266,578 @@ class SerialDispatchQueue:
         return future.result()
 
     def finish_work(self) -> Future:
-        return CentralDispatch.exhaust_futures(self.futures_queue)
+        return self.task_group.finished()
+
+    def cancel(self):
+        """Drops the tasks that haven't started, they're skipped when the pool reaches them"""
+        self.task_group.cancel()
+
+    def shutdown(self):
+        self.task_threadpool.shutdown(wait=False)
 
 
 class ConcurrentDispatchQueue:
-    def __init__(self, size, exception_handler):
+    def __init__(self, size, exception_handler, max_pending=None):
         self.exception_handler = exception_handler
         self.task_threadpool = ThreadPoolExecutor(size)
-        self.futures_queue = Queue()
+        self.task_group = TaskGroup(max_pending)
 
     def submit_async(self, block, *args, **kwargs) -> Future:
         task = self.exception_handler(block)
 
-        future = self.task_threadpool.submit(task, *args, **kwargs)
-        self.futures_queue.put(future)
+        return self.task_group.track(self.task_threadpool.submit, task, *args, **kwargs)
+
+    def await_result(self, block, *args, **kwargs):
+        future = self.submit_async(block, *args, **kwargs)
+
+        return future.result()
+
+    def finish_work(self) -> Future:
+        return self.task_group.finished()
+
+    def cancel(self):
+        """Drops the tasks that haven't started, they're skipped when the pool reaches them"""
+        self.task_group.cancel()
+
+    def shutdown(self):
+        self.task_threadpool.shutdown(wait=False)
+
+
+class LimitedDispatchQueue(ConcurrentDispatchQueue):
+    """
+        A concurrent queue that runs at most size tasks at once, size can be changed
+        while it works. Waiting tasks start lowest order first, then oldest first
+        With a score, a task's order is score called with its arguments instead
+        Scoring every waiting task again is slow once millions are waiting, so it's
+        only done when something the scores depend on changes and request_rescore
+        is called, at most once every rescore_interval
+    """
+    def __init__(self, size, exception_handler, label="Workers", rate_limiter=None, max_pending=None, score=None,
+                 rescore_interval=1.0):
+        super().__init__(size, exception_handler, max_pending)
+        self.size = size
+        self.label = label
+        # Shared between queues, each task takes a token from it before it runs
+        self.rate_limiter = rate_limiter
+        self.lock = threading.Lock()
+        # Tasks beyond the size wait here rather than in the pool, so the pool
+        # never starts more threads than are allowed to run
+        self.pending = []
+        self.submitted = itertools.count()
+        self.running = 0
+        self.completed = 0
+        self.total_latency = 0.0
+        self.score = score
+        self.rescore_requested = False
+        self.rescorer = None
+
+        if score is not None:
+            self.rescorer = CentralDispatch.schedule(rescore_interval, self._rescore_if_requested,
+                                                     repeat_every=rescore_interval)
+
+    def submit_async(self, block, *args, **kwargs) -> Future:
+        return self.submit_async_ordered(0, block, *args, **kwargs)
+
+    def submit_async_ordered(self, order, block, *args, **kwargs) -> Future:
+        return self.task_group.track(self._submit_ordered, block, order, *args, **kwargs)
+
+    def _submit_ordered(self, block, order, *args, **kwargs) -> Future:
+        return self._submit(order, block, args, kwargs)
+
+    def _submit(self, order, block, args, kwargs) -> Future:
+        future = Future()
+        task = self.exception_handler(block)
+        if self.score is not None:
+            order = self.score(*args, **kwargs)
+
+        with self.lock:
+            heapq.heappush(self.pending, (order, next(self.submitted), future, task, args, kwargs))
+        self._start_pending()
 
         return future
 
+    def _start_pending(self):
+        with self.lock:
+            while self.running < self.size and len(self.pending) > 0:
+                _, _, future, task, args, kwargs = heapq.heappop(self.pending)
+                self.running += 1
+                self.task_threadpool.submit(self._run, future, task, args, kwargs)
+
+    def _run(self, future: Future, task, args, kwargs):
+        if self.rate_limiter is not None:
+            self.rate_limiter.acquire()
+
+        started = time.monotonic()
+
+        try:
+            if future.set_running_or_notify_cancel():
+                future.set_result(task(*args, **kwargs))
+        except BaseException as e:
+            future.set_exception(e)
+        finally:
+            latency = time.monotonic() - started
+            if self.rate_limiter is not None:
+                self.rate_limiter.record_latency(latency)
+
+            with self.lock:
+                self.running -= 1
+                self.completed += 1
+                self.total_latency += latency
+
+            self._start_pending()
+
+    def request_rescore(self):
+        self.rescore_requested = True
+
+    def _rescore_if_requested(self):
+        if self.rescore_requested:
+            self.rescore_requested = False
+            self.rescore()
+
+    def rescore(self):
+        """
+            Scores every waiting task again and reorders them, the next size tasks
+            are left queued meanwhile so workers don't wait on it
+        """
+        with self.lock:
+            next_tasks = [heapq.heappop(self.pending) for _ in range(min(self.size, len(self.pending)))]
+            # Popped in order, so they already make a heap
+            waiting, self.pending = self.pending, next_tasks
+
+        rescored = [(self.score(*args, **kwargs), submitted, future, task, args, kwargs)
+                    for _, submitted, future, task, args, kwargs in waiting]
+
+        with self.lock:
+            self.pending.extend(rescored)
+            heapq.heapify(self.pending)
+
+        self._start_pending()
+
+    def cancel(self):
+        """Drops every waiting task at once, tasks already running are left to finish"""
+        self.task_group.cancel()
+        self.drop_pending()
+
+    def drop_pending(self):
+        with self.lock:
+            dropped, self.pending = self.pending, []
+
+        # Anything holding one of their futures hears they're cancelled, off the caller's thread
+        if len(dropped) > 0:
+            CentralDispatch.future(cancel_futures, [future for _, _, future, _, _, _ in dropped])
+
+    def shutdown(self):
+        if self.rescorer is not None:
+            self.rescorer.cancel()
+        super().shutdown()
+
+    def set_size(self, size):
+        with self.lock:
+            if size != self.size:
+                logger.info(f"{self.label}: {self.size} -> {size}")
+            self.size = size
+
+        self._start_pending()
+
+
+class AdaptiveDispatchQueue(LimitedDispatchQueue):
+    """
+        A limited queue whose size is tuned while it works
+        Every interval it compares tasks per second with the last interval, and
+        keeps stepping the size the same way while that helps, or turns around
+        when it doesn't. It only grows while tasks are waiting, and shrinks when
+        task latency rises without any gain in throughput
+    """
+    def __init__(self, size, min_size, max_size, exception_handler, label="Workers", rate_limiter=None,
+                 interval=0.5, max_pending=None, score=None):
+        super().__init__(max_size, exception_handler, label, rate_limiter, max_pending, score)
+        self.size = size
+        self.min_size = min_size
+        self.max_size = max_size
+        self.interval = interval
+        self.step = 1
+        self.last_rate = 0.0
+        self.last_latency = 0.0
+        self.last_time = time.monotonic()
+
+        self.tuner = CentralDispatch.schedule(interval, self._tune, repeat_every=interval)
+
+    def set_size(self, size):
+        super().set_size(max(self.min_size, min(self.max_size, size)))
+
+    def shutdown(self):
+        self.tuner.cancel()
+        super().shutdown()
+
+    def _tune(self):
+        with self.lock:
+            now = time.monotonic()
+            completed, self.completed = self.completed, 0
+            total_latency, self.total_latency = self.total_latency, 0.0
+            waiting = len(self.pending)
+
+        rate = completed / (now - self.last_time)
+        latency = total_latency / completed if completed > 0 else 0.0
+        self.last_time = now
+
+        # Without a backlog the rate is limited by the work coming in, not by the size
+        if completed == 0 or waiting == 0:
+            return
+
+        if rate < self.last_rate * 0.95 or (latency > self.last_latency * 1.5 and rate <= self.last_rate):
+            self.step = -self.step
+        elif rate < self.last_rate * 1.05:
+            # No real difference, so settle on the cheaper size
+            self.step = -1
+
+        self.last_rate = rate
+        self.last_latency = latency
+        self.set_size(self.size + self.step)
+
+
+class RoutingDispatchQueue:
+    """
+        Sends each task to a limited queue of its own per key, made by make_queue
+        the first time the key is seen, so each key gets its own concurrency
+        finish_work waits on the tasks of every key
+    """
+    def __init__(self, make_queue, max_pending=None):
+        self.make_queue = make_queue
+        self.queues = {}
+        self.lock = threading.Lock()
+        self.task_group = TaskGroup(max_pending)
+
+    def queue_for(self, key) -> LimitedDispatchQueue:
+        with self.lock:
+            queue = self.queues.get(key)
+
+            if queue is None:
+                queue = self.make_queue(key)
+                self.queues[key] = queue
+
+        return queue
+
+    def submit_async_to(self, key, order, block, *args, **kwargs) -> Future:
+        return self.task_group.track(self._submit_to, block, key, order, *args, **kwargs)
+
+    def _submit_to(self, block, key, order, *args, **kwargs) -> Future:
+        return self.queue_for(key)._submit(order, block, args, kwargs)
+
+    def finish_work(self) -> Future:
+        return self.task_group.finished()
+
+    def cancel(self):
+        """Drops the waiting tasks of every key at once, tasks already running are left to finish"""
+        self.task_group.cancel()
+
+        with self.lock:
+            queues = list(self.queues.values())
+
+        for queue in queues:
+            queue.drop_pending()
+
+    def request_rescore(self):
+        with self.lock:
+            queues = list(self.queues.values())
+
+        for queue in queues:
+            queue.request_rescore()
+
+    def shutdown(self):
+        with self.lock:
+            queues = list(self.queues.values())
+
+        for queue in queues:
+            queue.shutdown()
+
+
+class ScheduledTask:
+    """A task the scheduler runs once its delay is up, and again every repeat_every seconds until it's cancelled"""
+    def __init__(self, task, args, repeat_every=None):
+        self.task = task
+        self.args = args
+        self.repeat_every = repeat_every
+        self.cancelled = False
+
+    def cancel(self):
+        # Left in the heap, it's dropped when it comes due
+        self.cancelled = True
+
+    def run(self):
+        if not self.cancelled:
+            self.task(*self.args)
+
+
+class Scheduler:
+    """
+        Runs tasks on executor once they're due, from a single thread that sleeps
+        until the earliest one in a heap of timers, or until an earlier one is added
+        A repeating task is only scheduled again once it's run, so a slow one never
+        runs twice at the same time, and waits its full interval in between
+    """
+    def __init__(self, executor):
+        self.executor = executor
+        self.condition = threading.Condition()
+        self.timers = []
+        self.scheduled = itertools.count()
+        self.thread = None
+
+    def schedule(self, delay, task, args, repeat_every=None) -> ScheduledTask:
+        scheduled_task = ScheduledTask(task, args, repeat_every)
+        self._add(time.monotonic() + delay, scheduled_task)
+
+        return scheduled_task
+
+    def _add(self, due, scheduled_task: ScheduledTask):
+        with self.condition:
+            heapq.heappush(self.timers, (due, next(self.scheduled), scheduled_task))
+
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run_timers, name="Scheduler", daemon=True)
+                self.thread.start()
+
+            # Only an earlier timer changes how long the thread has to sleep
+            if self.timers[0][2] is scheduled_task:
+                self.condition.notify()
+
+    def _run_timers(self):
+        while True:
+            with self.condition:
+                while len(self.timers) == 0 or self.timers[0][0] > time.monotonic():
+                    self.condition.wait(max(0.0, self.timers[0][0] - time.monotonic()) if len(self.timers) > 0 else None)
+
+                _, _, scheduled_task = heapq.heappop(self.timers)
+
+            if not scheduled_task.cancelled:
+                try:
+                    self.executor.submit(self._run, scheduled_task)
+                except RuntimeError:
+                    # The executor's shut down as the interpreter exits, nothing's left to run
+                    return
+
+    def _run(self, scheduled_task: ScheduledTask):
+        try:
+            scheduled_task.run()
+        finally:
+            if scheduled_task.repeat_every is not None and not scheduled_task.cancelled:
+                self._add(time.monotonic() + scheduled_task.repeat_every, scheduled_task)
+
+
+class ProcessDispatchQueue:
+    """
+        Runs tasks in worker processes, so CPU bound work isn't serialized on the GIL
+        Tasks and their arguments must be picklable, so they can't be wrapped by an
+        exception handler, exceptions are raised by the returned future instead
+        Tasks given cancel_token stop once the queue is cancelled, like thread tasks
+    """
+    def __init__(self, size, max_pending=None):
+        context = multiprocessing.get_context()
+        self.cancel_token = ProcessCancellationToken(context.Event())
+        self.task_processpool = ProcessPoolExecutor(size, mp_context=context, initializer=_start_process_worker,
+                                                    initargs=(self.cancel_token.event,))
+        self.task_group = TaskGroup(max_pending)
+        self.cancelled = False
+
+    def submit_async(self, block, *args, **kwargs) -> Future:
+        if self.cancelled:
+            future = Future()
+            future.cancel()
+            return future
+
+        # Tasks run in other processes, so they're counted without being wrapped
+        self.task_group.add()
+
+        try:
+            future = self.task_processpool.submit(block, *args, **kwargs)
+        except BaseException:
+            self.task_group.done()
+            raise
+
+        future.add_done_callback(self.task_group.done)
+        return future
+
     def await_result(self, block, *args, **kwargs):
         future = self.submit_async(block, *args, **kwargs)
 
         return future.result()
 
     def finish_work(self) -> Future:
-        return CentralDispatch.exhaust_futures(self.futures_queue)
+        return self.task_group.finished()
+
+    def cancel(self):
+        """
+            Cancels the tasks that haven't been sent to a process, running ones stop when
+            they next check cancel_token, and tasks submitted from then on come back cancelled
+        """
+        self.cancelled = True
+        self.cancel_token.cancel()
+        self.task_processpool.shutdown(wait=False, cancel_futures=True)
+
+    def shutdown(self):
+        self.task_processpool.shutdown(wait=False)
+
+
+class Batch:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.items = []
+        self.started = 0
+
+
+class BatchingQueue:
+    """
+        Collects items put from many threads into a batch per thread, and submits
+        flush_block with a whole batch to the dispatch queue once the batch has
+        batch_size items, or its oldest item has waited flush_interval seconds
+        A timer flushes waiting batches too, so a thread that stops putting items
+        doesn't hold its last few back until the next flush
+    """
+    def __init__(self, dispatch_queue, flush_block, batch_size, flush_interval):
+        self.dispatch_queue = dispatch_queue
+        self.flush_block = flush_block
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.thread_batches = threading.local()
+        self.batches = []
+        self.batches_lock = threading.Lock()
+        self.flusher = CentralDispatch.schedule(flush_interval, self.flush_stale, repeat_every=flush_interval)
+
+    def _thread_batch(self) -> Batch:
+        batch = getattr(self.thread_batches, "batch", None)
+
+        if batch is None:
+            batch = Batch()
+            self.thread_batches.batch = batch
+            with self.batches_lock:
+                self.batches.append(batch)
+
+        return batch
+
+    def put(self, item):
+        batch = self._thread_batch()
+
+        with batch.lock:
+            if len(batch.items) == 0:
+                batch.started = time.monotonic()
+            batch.items.append(item)
+
+            if len(batch.items) >= self.batch_size or time.monotonic() - batch.started >= self.flush_interval:
+                self._flush(batch)
+
+    def _flush(self, batch: Batch):
+        if len(batch.items) > 0:
+            items = batch.items
+            batch.items = []
+            self.dispatch_queue.submit_async(self.flush_block, items)
+
+    def flush(self):
+        """Flushes every thread's batch, including the partially filled ones"""
+        with self.batches_lock:
+            batches = list(self.batches)
+
+        for batch in batches:
+            with batch.lock:
+                self._flush(batch)
+
+    def flush_stale(self):
+        """Flushes the batches whose oldest item has waited flush_interval seconds"""
+        with self.batches_lock:
+            batches = list(self.batches)
+
+        now = time.monotonic()
+        for batch in batches:
+            with batch.lock:
+                if len(batch.items) > 0 and now - batch.started >= self.flush_interval:
+                    self._flush(batch)
+
+    def shutdown(self):
+        self.flusher.cancel()
 
 
 class CentralDispatch:
 
     default_exception_handler = wrap_with_try
 
+    shared_executor_size = 64
+    shared_lock = threading.Lock()
+    _shared_executor = None
+    _scheduler = None
+
     @staticmethod
-    def create_serial_queue() -> SerialDispatchQueue:
-        return SerialDispatchQueue(exception_handler=CentralDispatch.default_exception_handler)
+    def create_serial_queue(max_pending=None) -> SerialDispatchQueue:
+        return SerialDispatchQueue(exception_handler=CentralDispatch.default_exception_handler,
+                                   max_pending=max_pending)
 
     @staticmethod
-    def create_concurrent_queue(size) -> ConcurrentDispatchQueue:
-        return ConcurrentDispatchQueue(size, exception_handler=CentralDispatch.default_exception_handler)
+    def create_concurrent_queue(size, max_pending=None) -> ConcurrentDispatchQueue:
+        return ConcurrentDispatchQueue(size, exception_handler=CentralDispatch.default_exception_handler,
+                                       max_pending=max_pending)
 
     @staticmethod
-    def future(block, *args, **kwargs) -> Future:
-        dispatch_queue = SerialDispatchQueue(exception_handler=CentralDispatch.default_exception_handler)
-        return dispatch_queue.submit_async(block, *args, **kwargs)
+    def create_limited_queue(size, label="Workers", rate_limiter=None, max_pending=None,
+                             score=None) -> LimitedDispatchQueue:
+        return LimitedDispatchQueue(size, exception_handler=CentralDispatch.default_exception_handler, label=label,
+                                    rate_limiter=rate_limiter, max_pending=max_pending, score=score)
 
     @staticmethod
-    def timer(interval, callback, *args) -> threading.Timer:
-        task = CentralDispatch.default_exception_handler(callback)
+    def create_adaptive_queue(size, min_size, max_size, label="Workers", rate_limiter=None,
+                              max_pending=None, score=None) -> AdaptiveDispatchQueue:
+        return AdaptiveDispatchQueue(size, min_size, max_size,
+                                     exception_handler=CentralDispatch.default_exception_handler, label=label,
+                                     rate_limiter=rate_limiter, max_pending=max_pending, score=score)
+
+    @staticmethod
+    def create_routing_queue(make_queue, max_pending=None) -> RoutingDispatchQueue:
+        return RoutingDispatchQueue(make_queue, max_pending=max_pending)
+
+    @staticmethod
+    def create_process_queue(size, max_pending=None) -> ProcessDispatchQueue:
+        return ProcessDispatchQueue(size, max_pending=max_pending)
+
+    @staticmethod
+    def create_task_group(max_pending=None) -> TaskGroup:
+        return TaskGroup(max_pending)
+
+    @staticmethod
+    def create_batching_queue(dispatch_queue, flush_block, batch_size, flush_interval) -> BatchingQueue:
+        return BatchingQueue(dispatch_queue, flush_block, batch_size, flush_interval)
+
+    @classmethod
+    def shared_executor(cls) -> ThreadPoolExecutor:
+        """
+            The pool behind every future and timer, made once and kept, idle threads
+            are reused so new ones are only started when all of them are busy
+            Some futures run for the whole session, like the key and event monitors,
+            so it's big enough that those never hold up short tasks
+        """
+        with cls.shared_lock:
+            if cls._shared_executor is None:
+                cls._shared_executor = ThreadPoolExecutor(cls.shared_executor_size, thread_name_prefix="Shared")
+
+            return cls._shared_executor
+
+    @classmethod
+    def scheduler(cls) -> Scheduler:
+        executor = cls.shared_executor()
+
+        with cls.shared_lock:
+            if cls._scheduler is None:
+                cls._scheduler = Scheduler(executor)
+
+            return cls._scheduler
+
+    @staticmethod
+    def future(block, *args, **kwargs) -> Future:
+        task = CentralDispatch.default_exception_handler(block)
 
-        timer = threading.Timer(interval, task, args)
-        timer.daemon = True
-        return timer
+        return CentralDispatch.shared_executor().submit(task, *args, **kwargs)
 
     @staticmethod
-    def exhaust_futures(future_queue: Queue) -> Future:
-        return CentralDispatch.future(wait_on_futures, future_queue)
+    def schedule(delay, callback, *args, repeat_every=None) -> ScheduledTask:
+        """Runs callback on the shared executor after delay seconds, then every repeat_every until cancelled"""
+        task = CentralDispatch.default_exception_handler(callback)
+
+        return CentralDispatch.scheduler().schedule(delay, task, args, repeat_every)
 
     @classmethod
     def concat(cls, *args):
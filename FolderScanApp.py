@@ -1,19 +1,69 @@
+import os
+import signal
+import threading
+import time
 from collections import namedtuple
+from concurrent.futures import Future
 from pathlib import Path
 from queue import Queue
 
+from loguru import logger
+
 from Application import Application
-from CentralDispatch import CentralDispatch
-from folder import Folder
-from foldercore import folder_from_path, sub_paths
+from CentralDispatch import CentralDispatch, LimitedDispatchQueue, RoutingDispatchQueue, CancellationToken, \
+    TaskCancelled
+from folder import Folder, FolderStats, SmallFolders
+from foldercore import scan_folder, scan_subtree, merge_subtree_records, drop_visited_records, oldest_biggest_key
+from devices import device_name, is_rotational
+from diff import diff_trees, rank_growth
+from duplicates import DuplicateFinder, DuplicateGroup, reclaimable
+from filesinks import FileSinks
+from folderwatch import FolderWatcher
+from inotify import InotifyUnavailable
+from largestfiles import LargeFile, LargestFiles
+from ratelimit import RateLimiter
+from scanfilter import ScanFilter, VisitedSet, CompactVisitedSet
+from scanindex import ScanIndex
+from snapshot import Snapshot, save_snapshot
+from topk import TopK
+from treestore import TreeStore
 
 ScanResult = namedtuple("ScanResult", ["folder"])
 ScanError = namedtuple("ScanError", ["error"])
 class ScanComplete: pass
 class ScanStarted: pass
+class ScanCancelled: pass
+
+
+class ScanCounters:
+    """Throughput counters for a folder scan, updated from the worker threads"""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.monotonic()
+        self.folders_scanned = 0
+        self.folders_merged = 0
+        self.batches_merged = 0
+
+    def add_scanned(self, count=1):
+        with self.lock:
+            self.folders_scanned += count
+
+    def add_merged(self, count):
+        with self.lock:
+            self.folders_merged += count
+            self.batches_merged += 1
+
+    def folders_per_second(self):
+        return self.folders_merged / max(time.monotonic() - self.started, 0.001)
+
+    def summary(self) -> str:
+        return f"{self.folders_merged} folders, {self.folders_per_second():.0f}/s in {self.batches_merged} merges"
 
 
 class FolderScanApp(Application):
+    # Most folders remembered as under the selected folder or not
+    under_selected_cache_size = 65536
+
     def __init__(self, args, curses_screen):
         super().__init__(curses_screen)
         self.args = args
@@ -21,38 +71,620 @@ class FolderScanApp(Application):
         self.collect_results_dispatch_queue = None
         self.folder_work_dispatch_queue = None
         self.folder_scan_tree = None
+        self.scan_index = None
+        self.folder_watcher = None
+        self.tree_store = None
+        self.make_folder = Folder
+        self.results_batcher = None
+        self.scan_counters = ScanCounters()
+        self.remaining_sub_folders = {}
+        self.subtree_listeners = [self.rank_oldest_biggest]
+        self.oldest_biggest = TopK(30, key=oldest_biggest_key)
+        self.largest_files = LargestFiles(args.largest_files) if args.largest_files > 0 else None
+        self.duplicate_finder = DuplicateFinder(args.duplicates_min_size * pow(1024, 2)) if args.duplicates else None
+        self.file_sink = None
+        self.duplicates_status = None
+        self.small_folders_by_parent = {}
+        self.scan_complete = False
+        self.compare_to = None
+        self.scan_filter = None
+        self.rate_limiter = RateLimiter()
+        # Cancelled to stop the scan, a new scan gets a new one
+        self.scan_token = CancellationToken()
+        self.scan_lock = threading.Lock()
+        self.scan_requests = 0
+        # What's on screen, sub folders of these are scanned first
+        self.visible_folders = frozenset()
+        # The selected folder and which folders are known to be under it or not, swapped
+        # together, so workers never check one selection against what's known of another
+        self.selection = (None, {})
 
     def on_start(self):
-        self.collect_results_dispatch_queue = CentralDispatch.create_serial_queue()
-        self.folder_work_dispatch_queue = CentralDispatch.create_concurrent_queue(size=5)
+        if self.args.diff is not None:
+            self.compare_to = Snapshot(self.args.diff).root
 
+        if self.args.open is not None:
+            self.open_snapshot(self.args.open)
+            return
+
+        self.setup_scan()
         self.start_folder_scan(self.args.path)
 
+    def run_headless(self, report):
+        """
+            Runs the scan pipeline on this thread without curses, handing each
+            subtree to report.write_folder as soon as it's completely scanned
+        """
+        self.shutdown_signal = Future()
+
+        if self.args.diff is not None:
+            self.compare_to = Snapshot(self.args.diff).root
+
+        if self.args.open is not None:
+            self.open_snapshot(self.args.open)
+        else:
+            self.add_subtree_listener(report.write_folder)
+            self.setup_scan()
+
+            try:
+                self._scan_folder(Path(self.args.path))
+            finally:
+                self.shutdown_signal.set_result(None)
+
+        growth = None
+        if self.compare_to is not None:
+            growth = rank_growth(diff_trees(self.compare_to, self.folder_scan_tree))
+
+        duplicates = self.duplicate_finder.groups if self.duplicate_finder is not None else None
+        report.finish(self.oldest_biggest.items(), growth, self.largest_file_items(), duplicates)
+
+    def setup_scan(self):
+        self.setup_scan_queues()
+        # Ctrl-C drops the queued work and interrupts listings, rather than waiting for them
+        self.shutdown_signal.add_done_callback(lambda _: self.cancel_scan())
+
+        if self.args.max_rate is not None:
+            if self.args.processes:
+                logger.warning("--max-rate has no effect with --processes, subtrees are scanned whole")
+            self.rate_limiter.set_rate(self.args.max_rate)
+
+        file_sinks = [sink for sink in (self.largest_files, self.duplicate_finder) if sink is not None]
+        if len(file_sinks) > 0:
+            self.file_sink = FileSinks(file_sinks)
+
+        if self.args.compact_tree:
+            self.tree_store = TreeStore()
+            self.make_folder = self.tree_store.make_folder
+
+        if len(self.args.exclude) > 0 or self.args.one_file_system or self.args.visited != "off":
+            self.scan_filter = ScanFilter(self.args.exclude)
+
+        if self.args.cache is not None:
+            self.scan_index = ScanIndex(self.args.cache)
+            if self.file_sink is not None:
+                logger.info("Folders unchanged since they were cached aren't listed again, "
+                            "the largest files and duplicates leave out their files")
+
+        if self.args.watch:
+            self.start_folder_watcher()
+
+        if self.args.prune is not None:
+            if self.tree_store is not None:
+                logger.warning("--prune has no effect with --compact-tree, stored folders aren't reclaimed")
+            else:
+                self.add_subtree_listener(self.prune_subtree)
+
+    def setup_scan_queues(self):
+        # Workers wait once this many merges are queued, rather than the tree falling further behind
+        self.collect_results_dispatch_queue = CentralDispatch.create_serial_queue(
+            max_pending=self.args.max_pending_merges or None
+        )
+        self.results_batcher = CentralDispatch.create_batching_queue(
+            self.collect_results_dispatch_queue, self.collect_results_batch,
+            batch_size=self.args.batch_size, flush_interval=0.5
+        )
+
+        if self.args.processes:
+            workers = self.args.workers or os.cpu_count()
+            self.folder_work_dispatch_queue = CentralDispatch.create_process_queue(size=workers)
+            logger.info(f"Scan workers: {workers} processes")
+        else:
+            self.folder_work_dispatch_queue = CentralDispatch.create_routing_queue(self.make_device_queue)
+
+    def stop_scan_queues(self):
+        """Stops the work queue's and the batcher's repeating timers, nothing is queued on them once a scan is over"""
+        self.folder_work_dispatch_queue.shutdown()
+        self.results_batcher.shutdown()
+
+    def cancel_scan(self):
+        """
+            Stops the scan under way, queued folders are dropped and folders being
+            listed stop at their next entry. What's been scanned so far stays, the
+            folders already listed are still merged into the tree
+        """
+        self.scan_token.cancel()
+
+        if self.folder_work_dispatch_queue is not None:
+            self.folder_work_dispatch_queue.cancel()
+
+    def restart_scan(self, path):
+        """Cancels the scan under way, if there is one, and scans path instead once it's stopped"""
+        with self.scan_lock:
+            self.scan_requests += 1
+            self.cancel_scan()
+            self.scan_complete = False
+
+            self.folder_scan_future = CentralDispatch.future(self._restart_scan, Path(path), self.scan_requests,
+                                                             self.folder_scan_future)
+
+    def _restart_scan(self, path: Path, scan_request, previous_scan: Future):
+        if previous_scan is not None:
+            try:
+                previous_scan.result()
+            except Exception:
+                # Cancelled, or failed and already reported by the exception handler
+                pass
+
+        with self.scan_lock:
+            # Another restart came in meanwhile, it scans its own path instead
+            if scan_request != self.scan_requests:
+                return
+
+            self.scan_token = CancellationToken()
+
+            if self.folder_work_dispatch_queue is None:
+                # Opened from a snapshot, nothing's set up for scanning yet
+                self.setup_scan()
+            else:
+                # The old scan's workers are all finished, nothing of it can reach the new scan
+                self.stop_scan_queues()
+                self.collect_results_dispatch_queue.shutdown()
+                self.setup_scan_queues()
+
+                if self.tree_store is not None:
+                    self.tree_store = TreeStore()
+                    self.make_folder = self.tree_store.make_folder
+
+                if self.folder_watcher is not None:
+                    self.folder_watcher.stop()
+                    self.start_folder_watcher()
+
+        self.duplicates_status = None
+
+        logger.info(f"Scanning {path}")
+        self.args.path = str(path)
+        self.event_queue.put(ScanStarted())
+        self._scan_folder(path)
+
+    def change_scan_rate(self, factor):
+        """
+            Speeds up or slows down the scan by factor, the first slow down limits it
+            to a fraction of the rate it's going at
+            An unlimited scan can't go any faster, speeding it up does nothing
+        """
+        rate = self.rate_limiter.rate
+        if rate is None:
+            if factor > 1:
+                return
+            rate = self.scan_counters.folders_per_second()
+
+        self.rate_limiter.set_rate(max(1.0, rate * factor))
+
+    def install_rate_signals(self):
+        """SIGUSR1 halves the scan rate, SIGUSR2 doubles it, where there are such signals"""
+        if not hasattr(signal, "SIGUSR1"):
+            return
+
+        # Handlers run on the main thread, which may be holding the limiter's lock
+        signal.signal(signal.SIGUSR1, lambda signum, frame: CentralDispatch.future(self.change_scan_rate, 0.5))
+        signal.signal(signal.SIGUSR2, lambda signum, frame: CentralDispatch.future(self.change_scan_rate, 2.0))
+
+    def make_device_queue(self, device) -> LimitedDispatchQueue:
+        """
+            Each file system gets its own workers, so a slow disk doesn't hold up a fast one
+            Unless -w is given, spinning disks scan one folder at a time in inode order,
+            to keep seeks short
+        """
+        label = "Scan workers" if device is None else f"Scan workers on {device_name(device)}"
+        score = self.folder_task_score if self.args.priority_scheduling == "auto" else None
+
+        if self.args.workers is not None:
+            logger.info(f"{label}: {self.args.workers}")
+            return CentralDispatch.create_limited_queue(self.args.workers, label, self.rate_limiter, score=score)
+        elif device is not None and is_rotational(device):
+            logger.info(f"{label}: 1, in inode order on a rotational disk")
+            return CentralDispatch.create_limited_queue(1, label, self.rate_limiter)
+        else:
+            logger.info(f"{label}: adaptive, starting at 5")
+            return CentralDispatch.create_adaptive_queue(size=5, min_size=1, max_size=64, label=label,
+                                                         rate_limiter=self.rate_limiter, score=score)
+
+    def show_folders(self, visible_folders: [Folder], selected_folder: Folder):
+        """Called by the UI with what it's showing, so those are scanned first"""
+        visible_folders = frozenset(visible_folders)
+        changed = False
+
+        if visible_folders != self.visible_folders:
+            self.visible_folders = visible_folders
+            changed = True
+
+        if selected_folder != self.selection[0]:
+            self.selection = (selected_folder, {})
+            changed = True
+
+        if changed and isinstance(self.folder_work_dispatch_queue, RoutingDispatchQueue):
+            self.folder_work_dispatch_queue.request_rescore()
+
+    def folder_task_score(self, path: Path, parent: Folder, device, depth) -> tuple:
+        """
+            Lowest first: folders under the selected one, then sub folders of those on
+            screen, then sub folders of the biggest folders so far, shallowest first
+        """
+        if self.is_under_selected_folder(parent):
+            shown = 0
+        elif parent in self.visible_folders:
+            shown = 1
+        else:
+            shown = 2
+
+        return shown, -parent.folder_stats.size, depth
+
+    def is_under_selected_folder(self, folder: Folder) -> bool:
+        selected_folder, under_selected_folder = self.selection
+
+        # The root is always selected at first, which puts nothing ahead
+        if selected_folder is None or selected_folder.parent is None:
+            return False
+
+        walked = []
+        under = False
+
+        while folder is not None:
+            known = under_selected_folder.get(folder)
+            if known is not None:
+                under = known
+                break
+            if folder == selected_folder:
+                under = True
+                break
+
+            walked.append(folder)
+            folder = folder.parent
+
+        # Kept from growing to every folder in the tree, and holding on to pruned ones,
+        # walks without it only go up as far as the selected folder or the root
+        if len(under_selected_folder) > self.under_selected_cache_size:
+            under_selected_folder.clear()
+
+        # Each folder is only walked up from once per selection
+        for walked_folder in walked:
+            under_selected_folder[walked_folder] = under
+
+        return under
+
+    def start_folder_watcher(self):
+        try:
+            self.folder_watcher = FolderWatcher(self.collect_results_dispatch_queue, self.make_folder,
+                                                self.args.deferred_rollup, self.scan_filter)
+        except InotifyUnavailable as e:
+            logger.warning(f"Live updates are off, inotify isn't available: {e}")
+            return
+
+        CentralDispatch.future(self.folder_watcher.run, self.shutdown_signal)
+
+    def open_snapshot(self, filename):
+        snapshot = Snapshot(filename)
+
+        self.folder_scan_tree = snapshot.root
+        for folder in snapshot.ranked_folders():
+            self.oldest_biggest.push(folder)
+
+        self.scan_complete = True
+        self.event_queue.put(ScanComplete())
+
+    def largest_file_items(self) -> [LargeFile]:
+        return self.largest_files.items() if self.largest_files is not None else []
+
+    def add_subtree_listener(self, callback):
+        """callback is called on the collect results queue with each folder whose subtree is fully scanned"""
+        self.subtree_listeners.append(callback)
+
+    def scan_summary(self) -> str:
+        summary = self.scan_counters.summary()
+
+        if isinstance(self.folder_work_dispatch_queue, RoutingDispatchQueue):
+            sizes = [str(queue.size) for queue in list(self.folder_work_dispatch_queue.queues.values())]
+            summary += f", {'/'.join(sizes)} workers"
+
+        if self.duplicates_status is not None:
+            summary += f", {self.duplicates_status}"
+
+        if self.rate_limiter.rate is not None:
+            summary += f", limited to {self.rate_limiter.effective_rate():.0f}/s"
+
+        if self.scan_filter is not None:
+            summary += f", {self.scan_filter.skipped} skipped"
+            if self.scan_filter.visited is not None:
+                summary += f", {self.scan_filter.revisited} already visited"
+
+        return summary
+
+    def rank_oldest_biggest(self, folder: Folder):
+        # Subtrees are only ranked once complete, when their size is final
+        if folder.parent is not None and folder.folder_stats.size >= self.args.min_size_gb * pow(1024, 3):
+            self.oldest_biggest.push(folder)
+
+    def prune_subtree(self, folder: Folder):
+        """
+            Collapses a completed subtree that's below the pruning size into its parent's
+            SmallFolders, so tiny folders don't each hold on to a Folder for the whole scan
+        """
+        parent = folder.parent
+        prune_size = self.args.prune * self.args.min_size_gb * pow(1024, 3)
+
+        if parent is None or folder.folder_stats.size >= prune_size:
+            return
+
+        # Anything under a pruned folder is at most as big, so it has been pruned already
+        count = 1
+        for sub_folder in folder.iter_folders():
+            count += sub_folder.count if isinstance(sub_folder, SmallFolders) else 1
+
+        self.small_folders_by_parent.pop(folder, None)
+        if self.folder_watcher is not None:
+            self.folder_watcher.unwatch_tree(folder)
+
+        small_folders = self.small_folders_by_parent.get(parent)
+        if small_folders is None:
+            small_folders = SmallFolders(parent)
+            parent.insert_folder(small_folders)
+            self.small_folders_by_parent[parent] = small_folders
+
+        parent.remove_folder(folder)
+        small_folders.add_folder(folder, count)
+
     def start_folder_scan(self, path):
-        CentralDispatch.future(self._scan_folder, Path(path))
+        self.folder_scan_future = CentralDispatch.future(self._scan_folder, Path(path))
 
     def _scan_folder(self, root_path: Path):
-        self.folder_scan_tree = folder_from_path(root_path, None)
+        self.scan_counters = ScanCounters()
+        self.scan_complete = False
+        self.oldest_biggest.clear()
+        if self.file_sink is not None:
+            self.file_sink.clear()
+        self.small_folders_by_parent = {}
+        self.remaining_sub_folders = {}
+        root_stat = os.stat(root_path)
+        if self.scan_filter is not None:
+            self.reset_scan_filter(root_stat)
 
-        for sub_folder_path in sub_paths(root_path):
-            self.folder_work_dispatch_queue.submit_async(
-                self.analyze_folder_task, sub_folder_path, self.folder_scan_tree
-            )
+        sub_folder_ids = {}
+        try:
+            self.folder_scan_tree, sub_folder_paths = scan_folder(root_path, None, self.scan_index, self.make_folder,
+                                                                  self.scan_filter, sub_folder_ids, self.args.dir_fd,
+                                                                  self.file_sink, self.scan_token)
+        except TaskCancelled:
+            self.folder_scan_tree = self.make_folder(root_path, None, FolderStats(0, 0))
+            logger.info("Scan cancelled while listing its root")
+            self.stop_scan_queues()
+            self.event_queue.put(ScanCancelled())
+            return
+
+        if self.folder_scan_tree is None:
+            # Excluded, it's still shown, without anything in it
+            self.folder_scan_tree = self.make_folder(root_path, None, FolderStats(0, 0))
+        # The root counts itself, it's completed once the scan is wrapped up below
+        self.remaining_sub_folders[self.folder_scan_tree] = len(sub_folder_paths) + 1
+        if self.folder_watcher is not None:
+            self.collect_results_dispatch_queue.submit_async(self.folder_watcher.watch, self.folder_scan_tree)
+
+        if self.args.processes:
+            self._scan_subtrees_in_processes(sub_folder_paths)
+        else:
+            for sub_folder_path in sub_folder_paths:
+                self.submit_folder_task(sub_folder_path, self.folder_scan_tree, root_stat.st_dev, sub_folder_ids, 1)
 
         self.folder_work_dispatch_queue.finish_work().result()
+        # Folders listed before a cancel are still merged, but the root never completes
+        self.results_batcher.flush()
+        if not self.scan_token.cancelled:
+            self.collect_results_dispatch_queue.submit_async(self.complete_folder, self.folder_scan_tree)
         self.collect_results_dispatch_queue.finish_work().result()
+        self.stop_scan_queues()
+
+        if self.scan_token.cancelled:
+            self.folder_scan_tree.rollup()
+            logger.info(f"Scan cancelled: {self.scan_summary()}")
+            self.event_queue.put(ScanCancelled())
+            return
 
+        self.folder_scan_tree.rollup()
+
+        if self.scan_index is not None:
+            self.scan_index.flush()
+
+        if self.args.save is not None:
+            save_snapshot(self.folder_scan_tree, self.args.save, self.oldest_biggest.items())
+
+        logger.info(f"Scan complete: {self.scan_summary()}")
+        self.scan_complete = True
         self.event_queue.put(ScanComplete())
 
+        if self.duplicate_finder is not None:
+            self.find_duplicates()
+
+    def find_duplicates(self) -> [DuplicateGroup]:
+        """Runs once the scan is complete, on the files it collected"""
+        self.duplicates_status = "finding duplicates"
+
+        read_limiter = RateLimiter(label="Duplicate reads", unit="bytes/s")
+        if self.args.read_bandwidth is not None:
+            read_limiter.set_rate(self.args.read_bandwidth * pow(1024, 2))
+
+        hash_queue = CentralDispatch.create_concurrent_queue(size=4)
+        process_queue = CentralDispatch.create_process_queue(size=self.args.workers or os.cpu_count())
+        try:
+            groups = self.duplicate_finder.find(hash_queue, process_queue, read_limiter, self.scan_token)
+        except TaskCancelled:
+            hash_queue.cancel()
+            process_queue.cancel()
+            self.duplicates_status = None
+            return []
+        finally:
+            hash_queue.shutdown()
+            process_queue.shutdown()
+
+        reclaimable_gb = sum(reclaimable(group) for group in groups) / pow(1024, 3)
+        self.duplicates_status = f"{reclaimable_gb:.2f}GB duplicated"
+        logger.info(f"Duplicates: {len(groups)} sets of identical files, {self.duplicates_status}")
+
+        return groups
+
+    def reset_scan_filter(self, root_stat: os.stat_result):
+        self.scan_filter.root_device = None
+        self.scan_filter.visited = None
+        self.scan_filter.skipped = 0
+        self.scan_filter.revisited = 0
+
+        if root_stat.st_ino == 0:
+            if self.args.one_file_system or self.args.visited != "off":
+                logger.warning("This file system has no inodes, --one-file-system and --visited have no effect")
+            return
+
+        if self.args.one_file_system:
+            self.scan_filter.root_device = root_stat.st_dev
+
+        if self.args.visited != "off":
+            self.scan_filter.visited = CompactVisitedSet() if self.args.visited == "compact" else VisitedSet()
+            # With a scan index, folders are checked when they stat themselves, the root included
+            if self.scan_index is None:
+                self.scan_filter.visited.add(root_stat.st_dev, root_stat.st_ino)
+
+    def _scan_subtrees_in_processes(self, sub_folder_paths):
+        # Each top level subtree is scanned whole in a worker process, then merged in here
+        futures = {}
+        # Futures the pool cancels on shutdown don't wake as_completed, their callbacks still run
+        done_futures = Queue()
+        for sub_folder_path in sub_folder_paths:
+            if self.scan_token.cancelled:
+                break
+
+            # The queue's own token reaches the worker processes, it's cancelled along with the scan
+            future = self.folder_work_dispatch_queue.submit_async(scan_subtree, sub_folder_path, self.args.cache,
+                                                                  self.scan_filter, self.args.dir_fd,
+                                                                  self.file_sink,
+                                                                  self.folder_work_dispatch_queue.cancel_token)
+            futures[future] = sub_folder_path
+            future.add_done_callback(done_futures.put)
+
+        for _ in range(len(futures)):
+            future = done_futures.get()
+            # Subtrees cut short by a cancel are dropped, the ones that were finished are merged
+            if future.cancelled() or isinstance(future.exception(), TaskCancelled):
+                continue
+
+            records, skipped, revisited, collected = future.result()
+            if self.scan_filter is not None:
+                self.scan_filter.add_skipped(skipped)
+                self.scan_filter.add_revisited(revisited)
+            if self.file_sink is not None:
+                self.file_sink.add_collected(collected)
+
+            self.collect_results_dispatch_queue.submit_async(
+                self.collect_subtree_results, records, futures[future], self.folder_scan_tree
+            )
+
+    def collect_subtree_results(self, records: [tuple], path: Path, parent: Folder):
+        # Each process has its own copy of the visited set, folders reachable from two
+        # top level subtrees are scanned in both, only the first one merged keeps them
+        if self.scan_filter is not None and self.scan_filter.visited is not None:
+            records, revisited = drop_visited_records(records, self.scan_filter.visited)
+            self.scan_filter.add_revisited(revisited)
+
+        if len(records) == 0:
+            self.complete_folder(parent)
+            return
+
+        folder = merge_subtree_records(records, path, parent, self.make_folder, self.args.deferred_rollup)
+        self.scan_counters.add_scanned(len(records))
+        self.scan_counters.add_merged(len(records))
+
+        if self.folder_watcher is not None:
+            self.folder_watcher.watch_tree(folder)
+
+        # Pre-order reversed puts every folder after all of its sub folders
+        folder.rollup()
+        for completed_folder in reversed([folder, *folder.iter_folders()]):
+            self.notify_subtree_complete(completed_folder)
+
+        self.complete_folder(parent)
+
+    def collect_results_batch(self, new_folders: [Folder]):
+        for new_folder in new_folders:
+            self.collect_results(new_folder)
+
+        self.scan_counters.add_merged(len(new_folders))
+
     def collect_results(self, new_folder: Folder):
-        new_folder.parent.insert_folder(new_folder)
+        if self.args.deferred_rollup:
+            new_folder.parent.insert_folder_deferred(new_folder)
+        else:
+            new_folder.parent.insert_folder(new_folder)
+
+        if self.folder_watcher is not None:
+            self.folder_watcher.watch(new_folder)
+
+        self.complete_folder(new_folder)
+
+    def complete_folder(self, folder: Folder):
+        """
+            Counts off one of folder's outstanding pieces, itself or a sub folder's subtree
+            When none are left its subtree is finished, which counts off one of its parent's
+        """
+        while folder is not None:
+            remaining = self.remaining_sub_folders[folder] - 1
+
+            if remaining > 0:
+                self.remaining_sub_folders[folder] = remaining
+                return
+
+            del self.remaining_sub_folders[folder]
+            # Listeners can detach the folder from the tree, e.g. pruning it
+            parent = folder.parent
+            folder.rollup()
+            self.notify_subtree_complete(folder)
+
+            folder = parent
+
+    def notify_subtree_complete(self, folder: Folder):
+        for listener in self.subtree_listeners:
+            listener(folder)
+
+    def submit_folder_task(self, path: Path, parent: Folder, parent_device, sub_folder_ids: dict, depth):
+        # Sub folders without ids, like cached ones, are taken to be on their parent's device
+        device, inode = sub_folder_ids.get(path.name, (parent_device, 0))
+        queue_key = device if self.args.device_scheduling == "auto" else None
+
+        # Queues with a score order tasks by it, the others by inode
+        self.folder_work_dispatch_queue.submit_async_to(queue_key, inode, self.analyze_folder_task, path, parent,
+                                                        device, depth)
+
+    def analyze_folder_task(self, path: Path, parent: Folder, device, depth):
+        sub_folder_ids = {}
+        folder, sub_folder_paths = scan_folder(path, parent, self.scan_index, self.make_folder, self.scan_filter,
+                                               sub_folder_ids, self.args.dir_fd, self.file_sink, self.scan_token)
+        self.scan_counters.add_scanned()
 
-    def analyze_folder_task(self, path: Path, parent: Folder):
-        folder = folder_from_path(path, parent)
+        # Already visited, its parent has one less sub folder to wait for
+        if folder is None:
+            self.collect_results_dispatch_queue.submit_async(self.complete_folder, parent)
+            return
+        # Set before any sub folder is submitted, they count it down as they complete
+        self.remaining_sub_folders[folder] = len(sub_folder_paths) + 1
 
-        for sub_folder_path in sub_paths(folder.path):
-            if not self.shutdown_signal.done():
-                self.folder_work_dispatch_queue.submit_async(self.analyze_folder_task, sub_folder_path, folder)
+        for sub_folder_path in sub_folder_paths:
+            if not self.scan_token.cancelled:
+                self.submit_folder_task(sub_folder_path, folder, device, sub_folder_ids, depth + 1)
 
-        if not self.shutdown_signal.done():
-            self.collect_results_dispatch_queue.submit_async(self.collect_results, folder)
+        # It's been listed, so it's kept even when the scan was cancelled meanwhile
+        self.results_batcher.put(folder)
@@ -5,8 +5,11 @@ import Keys
 from Activity import Activity
 from CentralDispatch import CentralDispatch
 from EventTypes import KeyStroke, ButtonEvent
-from FolderScanApp import ScanComplete, ScanStarted
+from FolderScanApp import ScanComplete, ScanStarted, ScanCancelled
 from activities.HelpActivity import HelpActivity
+from activities.LargestFilesActivity import LargestFilesActivity
+from activities.OldestBiggestActivity import OldestBiggestActivity
+from activities.ScanPathActivity import ScanPathActivity
 from foldercore import breadth_first, make_folder_tree
 from printers import make_top_bar, make_bottom_bar, make_spacer
 from ContextUtils import move_menu_left, move_menu_right, is_hidden
@@ -20,6 +23,7 @@ class FolderScanActivity(Activity):
         self.application.subscribe(event_type=KeyStroke, activity=self, callback=self.on_key_stroke)
         self.application.subscribe(event_type=ScanComplete, activity=self, callback=self.on_scan_complete)
         self.application.subscribe(event_type=ScanStarted, activity=self, callback=self.on_scan_started)
+        self.application.subscribe(event_type=ScanCancelled, activity=self, callback=self.on_scan_cancelled)
         self.application.subscribe(event_type=ButtonEvent, activity=self, callback=self.on_button_event)
 
         self.display_state = {"top_bar": {"items": {"title": "Beagle's Folder Analyzer",
@@ -27,6 +31,7 @@ class FolderScanActivity(Activity):
                                           "fixed_size": 2,
                                           "line_generator": make_top_bar},
                               "folder_tree": {"to_depth": 4,
+                                              "compare_to": self.application.compare_to,
                                               "folder_data": [],
                                               "selected_folder": None,
                                               "context_menu": {"label": "Menu",
@@ -41,7 +46,17 @@ class FolderScanActivity(Activity):
                                              "items": {"status": "Folder scan in progress"},
                                              "line_generator": make_bottom_bar}}
 
-        self._refresh_timer(shutdown_signal=self.application.shutdown_signal)
+        # The scan can finish, or a snapshot be opened, before this activity subscribes
+        if self.application.scan_complete:
+            self.display_state["bottom_bar"]["items"]["status"] = "Scan complete"
+        elif self.application.scan_token.cancelled:
+            self.display_state["bottom_bar"]["items"]["status"] = "Scan stopped"
+
+        # The tree, depth and rankings folder_data was built from
+        self.tree_key = None
+        self.refresh_tree_state()
+        self.refresh_task = CentralDispatch.schedule(1.0, self._refresh, self.application.shutdown_signal,
+                                                     repeat_every=1.0)
         # self.event_queue.put(KeyStroke(curses.KEY_F1))
 
     def on_button_event(self, event: ButtonEvent):
@@ -55,6 +70,18 @@ class FolderScanActivity(Activity):
 
         if chr(event.key) == "h":
             self.application.segue_to(HelpActivity())
+        elif chr(event.key) == "o":
+            self.application.segue_to(OldestBiggestActivity())
+        elif chr(event.key) == "f":
+            self.application.segue_to(LargestFilesActivity())
+        elif chr(event.key) == "+":
+            self.application.change_scan_rate(2.0)
+        elif chr(event.key) == "-":
+            self.application.change_scan_rate(0.5)
+        elif chr(event.key) == "x":
+            self.application.cancel_scan()
+        elif chr(event.key) == "n":
+            self.application.segue_to(ScanPathActivity())
         elif chr(event.key) == "e":
             raise Exception("This is just a test")
         else:
@@ -68,6 +95,9 @@ class FolderScanActivity(Activity):
     def on_scan_started(self, event: ScanStarted):
         self.update_bottom_bar("status", "Folder scan in progress")
 
+    def on_scan_cancelled(self, event: ScanCancelled):
+        self.update_bottom_bar("status", "Scan stopped")
+
     def _handle_folder_tree_input(self, fold_tree_context, event):
         if chr(event.key) == " " or chr(event.key) == Keys.ENTER:
             self.toggle_context_menu()
@@ -92,26 +122,51 @@ class FolderScanActivity(Activity):
                 self.application.event_queue.put(button_event)
                 self.toggle_context_menu()
 
-    def _refresh_timer(self, shutdown_signal):
-        timer = CentralDispatch.timer(1.0, self._refresh_timer, shutdown_signal)
+    def on_stop(self):
+        self.refresh_task.cancel()
 
-        if not shutdown_signal.done() and self.application is not None:
-            timer.start()
+    def _refresh(self, shutdown_signal):
+        # Runs on the scheduler, the activity can be stopped, and lose its application, meanwhile
+        application = self.application
+        if shutdown_signal.done() or application is None:
+            self.refresh_task.cancel()
+            return
 
-            self.refresh_tree_state()
+        self.update_tree_state(application)
 
-            if not shutdown_signal.done():
-                self.application.main_thread.submit_async(self.refresh_screen)
+        # The screen is drawn on the main thread, which only does it while the activity is running
+        if not shutdown_signal.done():
+            self.main_thread.submit_async(self.refresh_screen)
 
     def refresh_tree_state(self):
-        if self.application.folder_scan_tree is not None:
+        self.update_tree_state(self.application)
+        self.refresh_screen()
+
+    def update_tree_state(self, application):
+        if application.folder_scan_tree is not None:
             context = self.display_state["folder_tree"]
-            context["folder_data"] = breadth_first(self.application.folder_scan_tree, to_depth=context["to_depth"])
+            tree = application.folder_scan_tree
+
+            # Only walked again when the ranking of a folder it went into changed, or the depth did
+            tree.rollup()
+            tree_key = (tree, context["to_depth"],
+                        [folder.version for folder, depth in context["folder_data"] if depth < context["to_depth"]])
+            if tree_key != self.tree_key:
+                versions = []
+                context["folder_data"] = breadth_first(tree, context["to_depth"], versions)
+                self.tree_key = (tree, context["to_depth"], versions)
 
             if context["selected_folder"] is None:
                 context["selected_folder"] = context["folder_data"][0][0]
 
-            self.update_scroll_percent()
+            application.show_folders([folder for folder, _ in context["folder_data"]], context["selected_folder"])
+
+            if application.duplicate_finder is not None:
+                context["reclaimable"] = application.duplicate_finder.reclaimable_by_folder
+
+            self.display_state["bottom_bar"]["items"]["progress"] = application.scan_summary()
+
+            self.set_scroll_percent()
 
     def _index_of_selected_folder(self):
         context = self.display_state["folder_tree"]
@@ -120,6 +175,10 @@ class FolderScanActivity(Activity):
         while context["selected_folder"] is not None and context["selected_folder"] not in folders:
             context["selected_folder"] = context["selected_folder"].parent
 
+        # The selected folder was removed from the tree, e.g. pruned
+        if context["selected_folder"] is None:
+            context["selected_folder"] = folders[0]
+
         index = folders.index(context["selected_folder"])
         return index, folders
 
@@ -148,12 +207,15 @@ class FolderScanActivity(Activity):
         self.update_scroll_percent()
 
     def update_scroll_percent(self):
+        self.set_scroll_percent()
+        self.refresh_screen()
+
+    def set_scroll_percent(self):
         index, folders = self._index_of_selected_folder()
 
         percent = int(index/len(folders)*100)
 
-        self.update_bottom_bar("scroll_percent", f"Scroll: {percent}%")
-        self.refresh_screen()
+        self.display_state["bottom_bar"]["items"]["scroll_percent"] = f"Scroll: {percent}%"
 
     def update_bottom_bar(self, tag, value):
         self.display_state["bottom_bar"]["items"][tag] = value
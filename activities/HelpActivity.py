@@ -14,6 +14,11 @@ commands = [
     "[       | Collapse tree up one level",
     "]       | Expand tree one level lower",
     "h       | Show this help",
+    "o       | Show the oldest biggest folders",
+    "f       | Show the largest files",
+    "+/-     | Double or halve the scan rate",
+    "x       | Stop the scan",
+    "n       | Scan a different folder",
     "F1      | Show application log",
     "Ctrl-C  | Exit the program"
 ]
@@ -0,0 +1,62 @@
+import curses
+from functools import partial
+
+import Keys
+from Activity import Activity
+from CentralDispatch import CentralDispatch
+from ContextUtils import scroll_up, scroll_down
+from EventTypes import KeyStroke
+from printers import make_top_bar, make_scroll_list, make_spacer, make_bottom_bar
+
+
+class LargestFilesActivity(Activity):
+    def __init__(self):
+        super().__init__()
+
+    def on_start(self):
+        self.application.subscribe(KeyStroke, self, self.on_key_stroke)
+
+        self.display_state = {"top_bar": {"items": {"title": "Largest files",
+                                                    "help": "Press ESC to return"},
+                                          "fixed_size": 2,
+                                          "line_generator": make_top_bar},
+                              "file_list": {"items": [],
+                                              "focused": True,
+                                              "line_generator": partial(make_scroll_list, self.screen)},
+                              "spacer": {"line_generator": make_spacer},
+                              "bottom_bar": {"fixed_size": 2,
+                                             "items": {"count": ""},
+                                             "line_generator": make_bottom_bar}}
+
+        self.refresh_file_list()
+        self.refresh_task = CentralDispatch.schedule(1.0, self._refresh, self.application.shutdown_signal,
+                                                     repeat_every=1.0)
+
+    def on_stop(self):
+        self.refresh_task.cancel()
+
+    def _refresh(self, shutdown_signal):
+        if shutdown_signal.done() or self.lifecycle_state == "stopped":
+            self.refresh_task.cancel()
+        else:
+            self.main_thread.submit_async(self.refresh_file_list)
+
+    def refresh_file_list(self):
+        if self.lifecycle_state == "stopped":
+            return
+
+        files = self.application.largest_file_items()
+
+        self.display_state["file_list"]["items"] = files
+        self.display_state["bottom_bar"]["items"]["count"] = f"Showing {len(files)} files"
+        self.refresh_screen()
+
+    def on_key_stroke(self, event: KeyStroke):
+        if event.key == Keys.ESC:
+            self.application.pop_activity()
+
+        if event.key == curses.KEY_UP:
+            scroll_up(self.display_state["file_list"])
+        if event.key == curses.KEY_DOWN:
+            scroll_down(self.display_state["file_list"])
+        self.refresh_screen()
@@ -0,0 +1,62 @@
+import curses
+from functools import partial
+
+import Keys
+from Activity import Activity
+from CentralDispatch import CentralDispatch
+from ContextUtils import scroll_up, scroll_down
+from EventTypes import KeyStroke
+from printers import make_top_bar, make_scroll_list, make_spacer, make_bottom_bar
+
+
+class OldestBiggestActivity(Activity):
+    def __init__(self):
+        super().__init__()
+
+    def on_start(self):
+        self.application.subscribe(KeyStroke, self, self.on_key_stroke)
+
+        self.display_state = {"top_bar": {"items": {"title": "Oldest biggest folders",
+                                                    "help": "Press ESC to return"},
+                                          "fixed_size": 2,
+                                          "line_generator": make_top_bar},
+                              "folder_list": {"items": [],
+                                              "focused": True,
+                                              "line_generator": partial(make_scroll_list, self.screen)},
+                              "spacer": {"line_generator": make_spacer},
+                              "bottom_bar": {"fixed_size": 2,
+                                             "items": {"count": ""},
+                                             "line_generator": make_bottom_bar}}
+
+        self.refresh_folder_list()
+        self.refresh_task = CentralDispatch.schedule(1.0, self._refresh, self.application.shutdown_signal,
+                                                     repeat_every=1.0)
+
+    def on_stop(self):
+        self.refresh_task.cancel()
+
+    def _refresh(self, shutdown_signal):
+        if shutdown_signal.done() or self.lifecycle_state == "stopped":
+            self.refresh_task.cancel()
+        else:
+            self.main_thread.submit_async(self.refresh_folder_list)
+
+    def refresh_folder_list(self):
+        if self.lifecycle_state == "stopped":
+            return
+
+        folders = self.application.oldest_biggest.items()
+
+        self.display_state["folder_list"]["items"] = folders
+        self.display_state["bottom_bar"]["items"]["count"] = f"Showing {len(folders)} folders"
+        self.refresh_screen()
+
+    def on_key_stroke(self, event: KeyStroke):
+        if event.key == Keys.ESC:
+            self.application.pop_activity()
+
+        if event.key == curses.KEY_UP:
+            scroll_up(self.display_state["folder_list"])
+        if event.key == curses.KEY_DOWN:
+            scroll_down(self.display_state["folder_list"])
+        self.refresh_screen()
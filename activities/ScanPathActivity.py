@@ -0,0 +1,56 @@
+import os
+
+import Keys
+from Activity import Activity
+from EventTypes import KeyStroke
+from input_handlers import handle_text_box_input, TextBoxSubmit
+from printers import make_top_bar, make_text_input, make_spacer, make_bottom_bar
+
+
+class ScanPathActivity(Activity):
+    """Asks for a folder to scan, the scan under way is cancelled once it's entered"""
+    def __init__(self):
+        super().__init__()
+
+    def on_start(self):
+        self.application.subscribe(KeyStroke, self, self.on_key_stroke)
+        self.application.subscribe(TextBoxSubmit, self, self.on_enter_pressed)
+
+        path = self.application.args.path or ""
+
+        self.display_state = {"top_bar": {"items": {"title": "Scan a different folder",
+                                                    "help": "Press ENTER to scan, ESC to return"},
+                                          "fixed_size": 2,
+                                          "line_generator": make_top_bar},
+                              "path_input": {"label": "Folder",
+                                             "text": path,
+                                             "cursor_index": len(path),
+                                             "focused": True,
+                                             "fixed_size": 1,
+                                             "line_generator": make_text_input,
+                                             "input_handler": handle_text_box_input},
+                              "spacer": {"line_generator": make_spacer},
+                              "bottom_bar": {"items": {},
+                                             "fixed_size": 2,
+                                             "line_generator": make_bottom_bar}}
+
+    def on_enter_pressed(self, event: TextBoxSubmit):
+        path = self.display_state["path_input"]["text"].strip()
+
+        if not os.path.isdir(path):
+            self.display_state["bottom_bar"]["items"]["status"] = f"Not a folder: {path}"
+            self.refresh_screen()
+            return
+
+        self.application.restart_scan(path)
+        self.application.pop_activity()
+
+    def on_key_stroke(self, event: KeyStroke):
+        if event.key == Keys.ESC:
+            self.application.pop_activity()
+            return
+
+        context = self.display_state["path_input"]
+        context["input_handler"]("path_input", context, event, self.event_queue)
+
+        self.refresh_screen()
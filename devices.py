@@ -0,0 +1,37 @@
+import os
+import sys
+from pathlib import Path
+
+
+def device_name(device) -> str:
+    # Only Unix has major and minor device numbers
+    if not hasattr(os, "major"):
+        return str(device)
+
+    return f"{os.major(device)}:{os.minor(device)}"
+
+
+def is_rotational(device) -> bool:
+    """
+        Whether the block device behind a file system's st_dev is a spinning disk
+        Partitions take it from their whole disk, anything that isn't a local
+        block device, like tmpfs or NFS, counts as not rotational, as does
+        every disk outside Linux, which is the only place it can be told
+    """
+    if not sys.platform.startswith("linux"):
+        return False
+
+    block_device = Path("/sys/dev/block", device_name(device))
+
+    try:
+        block_device = block_device.resolve(strict=True)
+    except OSError:
+        return False
+
+    for queue in (block_device / "queue", block_device.parent / "queue"):
+        try:
+            return (queue / "rotational").read_text().strip() == "1"
+        except OSError:
+            continue
+
+    return False
@@ -0,0 +1,110 @@
+from collections import namedtuple
+from datetime import datetime
+from pathlib import Path
+
+from folder import FolderStats
+from topk import TopK
+
+FolderDelta = namedtuple("FolderDelta", ["path", "old_stats", "new_stats"])
+
+EMPTY_STATS = FolderStats(0, 0)
+
+
+def folder_name(folder) -> str:
+    return folder.name
+
+
+def size_delta(delta: FolderDelta) -> int:
+    return delta.new_stats.size - delta.old_stats.size
+
+
+def modified_change(delta: FolderDelta) -> str:
+    """When the folder was last modified in the old tree and now, only now if it wasn't in the old tree"""
+    new_modified = datetime.utcfromtimestamp(delta.new_stats.last_modified).strftime('%Y-%m-%dTZ')
+    if delta.old_stats is EMPTY_STATS:
+        return "new, modified {new_modified}".format(new_modified=new_modified)
+
+    old_modified = datetime.utcfromtimestamp(delta.old_stats.last_modified).strftime('%Y-%m-%dTZ')
+    if old_modified == new_modified:
+        return "modified {new_modified}".format(new_modified=new_modified)
+
+    return "modified {old_modified} -> {new_modified}".format(old_modified=old_modified, new_modified=new_modified)
+
+
+def _sorted_sub_folders(folder) -> list:
+    if folder is None:
+        return []
+
+    return sorted(folder.folders, key=folder_name)
+
+
+def _pair_sub_folders(old_folder, new_folder):
+    """Merge joins the two folders' sub folders by name, None stands in for a missing side"""
+    old_sub_folders = _sorted_sub_folders(old_folder)
+    new_sub_folders = _sorted_sub_folders(new_folder)
+    old_index = 0
+    new_index = 0
+
+    while old_index < len(old_sub_folders) or new_index < len(new_sub_folders):
+        old_name = folder_name(old_sub_folders[old_index]) if old_index < len(old_sub_folders) else None
+        new_name = folder_name(new_sub_folders[new_index]) if new_index < len(new_sub_folders) else None
+
+        if new_name is None or (old_name is not None and old_name < new_name):
+            yield old_name, old_sub_folders[old_index], None
+            old_index += 1
+        elif old_name is None or new_name < old_name:
+            yield new_name, None, new_sub_folders[new_index]
+            new_index += 1
+        else:
+            yield new_name, old_sub_folders[old_index], new_sub_folders[new_index]
+            old_index += 1
+            new_index += 1
+
+
+def diff_trees(old_root, new_root):
+    """
+        Walks both trees together in path order, yielding a FolderDelta for every
+        folder in either of them, in time linear in the number of folders
+        Folders only in one tree are compared against empty stats
+    """
+    stack = [(Path(new_root.path), old_root, new_root)]
+
+    while len(stack) > 0:
+        path, old_folder, new_folder = stack.pop()
+
+        old_stats = old_folder.folder_stats if old_folder is not None else EMPTY_STATS
+        new_stats = new_folder.folder_stats if new_folder is not None else EMPTY_STATS
+        yield FolderDelta(path, old_stats, new_stats)
+
+        for name, old_sub_folder, new_sub_folder in _pair_sub_folders(old_folder, new_folder):
+            stack.append((path / name, old_sub_folder, new_sub_folder))
+
+
+def rank_growth(deltas, k=30) -> [FolderDelta]:
+    """The k folders that grew the most"""
+    grown = TopK(k, key=lambda delta: (-size_delta(delta),))
+
+    for delta in deltas:
+        if size_delta(delta) > 0:
+            grown.push(delta)
+
+    return grown.items()
+
+
+def find_folder(root, path: Path):
+    """
+        Finds the folder at path under a snapshot's root, by binary searching
+        each level's name sorted sub folders, without reading the rest of the snapshot
+    """
+    try:
+        names = path.relative_to(root.path).parts
+    except ValueError:
+        return None
+
+    folder = root
+    for name in names:
+        folder = folder.find_sub_folder(name)
+        if folder is None:
+            return None
+
+    return folder
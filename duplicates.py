@@ -0,0 +1,156 @@
+import hashlib
+import mmap
+import threading
+from collections import namedtuple, defaultdict
+from pathlib import Path
+
+from CentralDispatch import CancellationToken
+from ratelimit import RateLimiter
+
+DuplicateGroup = namedtuple("DuplicateGroup", ["size", "paths"])
+
+PARTIAL_HASH_SIZE = 64 * 1024
+
+
+def reclaimable(group: DuplicateGroup) -> int:
+    """Every copy but one could go"""
+    return group.size * (len(group.paths) - 1)
+
+
+def partial_hash(path: Path, read_limiter: RateLimiter = None) -> bytes:
+    """Hash of the start of the file, files no bigger than that are hashed whole"""
+    if read_limiter is not None:
+        read_limiter.acquire(PARTIAL_HASH_SIZE)
+
+    try:
+        with open(path, "rb") as file:
+            return hashlib.blake2b(file.read(PARTIAL_HASH_SIZE)).digest()
+    except OSError:
+        return None
+
+
+def full_hash(path: Path) -> bytes:
+    """Hash of the whole file, read through mmap so it's never copied into the process"""
+    try:
+        with open(path, "rb") as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            return hashlib.blake2b(mapped).digest()
+    except (OSError, ValueError):
+        return None
+
+
+class DuplicateFinder:
+    """
+        Collects the files of at least min_size bytes as the scan stats them,
+        bucketed by size, then narrows down which are identical in stages:
+        only sizes shared by several files get the start of each file hashed,
+        and only files whose start hashes match get hashed whole
+        Hard links to the same file aren't duplicates, nothing can be reclaimed
+    """
+    def __init__(self, min_size):
+        self.min_size = min_size
+        self.lock = threading.Lock()
+        # size -> {(st_dev, st_ino): (folder_path, name)}
+        self.files_by_size = defaultdict(dict)
+        self.groups = []
+        self.reclaimable_by_folder = {}
+
+    def offer(self, folder_path, name, stat):
+        if stat.st_size >= self.min_size:
+            with self.lock:
+                self.files_by_size[stat.st_size][(stat.st_dev, stat.st_ino)] = (folder_path, name)
+
+    def collected(self) -> dict:
+        return self.files_by_size
+
+    def add_collected(self, files_by_size: dict):
+        with self.lock:
+            for size, files in files_by_size.items():
+                self.files_by_size[size].update(files)
+
+    def clear(self):
+        with self.lock:
+            self.files_by_size = defaultdict(dict)
+        self.groups = []
+        self.reclaimable_by_folder = {}
+
+    # The lock can't be pickled, worker processes start empty
+    def __getstate__(self):
+        return {"min_size": self.min_size}
+
+    def __setstate__(self, state):
+        self.__init__(state["min_size"])
+
+    def find(self, hash_queue, process_queue, read_limiter: RateLimiter = None,
+             cancel_token: CancellationToken = None) -> [DuplicateGroup]:
+        """
+            Start hashes run on hash_queue's threads, whole file hashes on process_queue
+            Reads are paced by read_limiter, whole files before they're submitted
+            A cancelled cancel_token stops it between files, with TaskCancelled
+        """
+        def check_cancelled():
+            if cancel_token is not None:
+                cancel_token.raise_if_cancelled()
+
+        def hash_results(hashed_files):
+            for size, path, future in hashed_files:
+                check_cancelled()
+                yield (size, future.result()), path
+
+        with self.lock:
+            same_sizes = [(size, [Path(folder_path, name) for folder_path, name in files.values()])
+                          for size, files in self.files_by_size.items() if len(files) > 1]
+
+        partial_hashes = []
+        for size, paths in same_sizes:
+            for path in paths:
+                check_cancelled()
+                partial_hashes.append((size, path, hash_queue.submit_async(partial_hash, path, read_limiter)))
+
+        candidates = self._group(hash_results(partial_hashes))
+
+        full_hashes = []
+        groups = []
+        for (size, _), paths in candidates.items():
+            if size <= PARTIAL_HASH_SIZE:
+                groups.append(DuplicateGroup(size, sorted(paths)))
+                continue
+
+            for path in paths:
+                check_cancelled()
+                if read_limiter is not None:
+                    read_limiter.acquire(size)
+                full_hashes.append((size, path, process_queue.submit_async(full_hash, path)))
+
+        matches = self._group(hash_results(full_hashes))
+        groups += [DuplicateGroup(size, sorted(paths)) for (size, _), paths in matches.items()]
+
+        self.groups = sorted(groups, key=reclaimable, reverse=True)
+        self.reclaimable_by_folder = self._reclaimable_by_folder(self.groups)
+
+        return self.groups
+
+    @staticmethod
+    def _group(hashed_files) -> dict:
+        """Groups ((size, hash), path) by size and hash, keeping groups of more than one file that could be read"""
+        groups = defaultdict(list)
+
+        for key, path in hashed_files:
+            if key[1] is not None:
+                groups[key].append(path)
+
+        return {key: paths for key, paths in groups.items() if len(paths) > 1}
+
+    @staticmethod
+    def _reclaimable_by_folder(groups: [DuplicateGroup]) -> dict:
+        """
+            Bytes taken by copies, the first path of each group counts as the
+            original, added to every folder above each copy, keyed by path
+        """
+        reclaimable_by_folder = defaultdict(int)
+
+        for group in groups:
+            for path in group.paths[1:]:
+                for folder_path in path.parents:
+                    reclaimable_by_folder[str(folder_path)] += group.size
+
+        return dict(reclaimable_by_folder)
@@ -0,0 +1,24 @@
+class FileSinks:
+    """
+        Hands every file the scan stats to each of sinks, which all have
+        offer(folder_path, name, stat), collected() and add_collected(collected)
+        Worker processes send back what their sinks collected for a subtree,
+        to be added to the sinks of the scan
+    """
+    def __init__(self, sinks):
+        self.sinks = sinks
+
+    def offer(self, folder_path, name, stat):
+        for sink in self.sinks:
+            sink.offer(folder_path, name, stat)
+
+    def collected(self) -> list:
+        return [sink.collected() for sink in self.sinks]
+
+    def add_collected(self, collected: list):
+        for sink, sink_collected in zip(self.sinks, collected):
+            sink.add_collected(sink_collected)
+
+    def clear(self):
+        for sink in self.sinks:
+            sink.clear()
@@ -1,3 +1,5 @@
+import heapq
+import os
 from datetime import datetime
 from pathlib import Path
 
@@ -8,18 +10,119 @@ class FolderStats:
         self.last_modified = last_modified
 
 
+def folder_size(folder) -> int:
+    return folder.folder_stats.size
+
+
 class Folder:
+    # How many of the biggest sub folders each folder keeps ranked
+    ranked_count = 4
+
     def __init__(self, path: Path, parent, folder_stats: FolderStats):
-        self.path = path
+        # Only a root keeps its full path, below it a folder's path is rebuilt from
+        # the names up to the root when it's asked for, so a name is enough
+        self.name = os.path.basename(path)
+        self.root_path = Path(path) if parent is None else None
         self.folders = []
         self.parent = parent
         self.folder_stats = folder_stats
+        # Stats of the folder's own entries, not counting sub folders
+        self.file_stats = FolderStats(folder_stats.size, folder_stats.last_modified)
+        self.dirty = False
+        self.inserted = False
+        # The biggest sub folders, biggest first, kept up to date by whatever changes
+        # the tree, and only read from elsewhere
+        self.ranked_folders = []
+        # Goes up whenever the ranking changes, sizes alone changing don't count
+        self.version = 0
+
+    @property
+    def path(self) -> Path:
+        names = []
+        folder = self
+
+        while folder.root_path is None:
+            names.append(folder.name)
+            folder = folder.parent
+
+        return folder.root_path.joinpath(*reversed(names))
 
     def insert_folder(self, folder):
         self.folders.append(folder)
+        folder.inserted = True
 
+        self.rank_sub_folder(folder, folder.folder_stats.size)
         self.update_folder_stats(folder.folder_stats)
 
+    def insert_folder_deferred(self, folder):
+        """
+            Inserts without updating any totals, the ancestors are only marked dirty
+            until rollup recomputes them
+        """
+        self.folders.append(folder)
+        folder.inserted = True
+
+        self.mark_dirty()
+
+    def mark_dirty(self):
+        current_node = self
+
+        # Stops at the first dirty ancestor, everything above it is already marked
+        while current_node is not None and not current_node.dirty:
+            current_node.dirty = True
+            current_node = current_node.parent
+
+    def rollup(self):
+        """
+            Recomputes the totals of every dirty folder under this one, children first
+            A folder's flag is cleared before its children are summed, so a folder
+            inserted while this runs marks it dirty again for the next rollup
+        """
+        if not self.dirty:
+            return
+
+        stack = [(self, False)]
+
+        while len(stack) > 0:
+            folder, children_done = stack.pop()
+
+            if children_done:
+                size = folder.file_stats.size
+                last_modified = folder.file_stats.last_modified
+
+                for sub_folder in folder.folders:
+                    size += sub_folder.folder_stats.size
+                    last_modified = max(last_modified, sub_folder.folder_stats.last_modified)
+
+                folder.folder_stats.size = size
+                folder.folder_stats.last_modified = last_modified
+                folder.rank_sub_folders()
+            else:
+                folder.dirty = False
+                stack.append((folder, True))
+
+                for sub_folder in folder.folders:
+                    if sub_folder.dirty:
+                        stack.append((sub_folder, False))
+
+    def remove_folder(self, folder):
+        self.folders.remove(folder)
+
+        if folder in self.ranked_folders:
+            self.rank_sub_folders()
+
+        self.update_folder_stats(FolderStats(-folder.folder_stats.size, 0))
+        # A removed folder keeps its path, without a parent it couldn't be rebuilt
+        folder.root_path = folder.path
+        folder.parent = None
+        folder.inserted = False
+
+    def update_file_stats(self, file_stats: FolderStats):
+        size_delta = file_stats.size - self.file_stats.size
+        self.file_stats = file_stats
+
+        self.update_folder_stats(FolderStats(size_delta, file_stats.last_modified))
+
     def update_folder_stats(self, leaf_node_folder_stats):
         current_node = self
 
@@ -27,8 +130,45 @@ class Folder:
             current_node.folder_stats.size = current_node.folder_stats.size + leaf_node_folder_stats.size
             current_node.folder_stats.last_modified = max(current_node.folder_stats.last_modified, leaf_node_folder_stats.last_modified)
 
+            # Results can arrive before their parent's, a folder that isn't in the tree
+            # yet brings these totals along when it's inserted
+            if not current_node.inserted:
+                break
+
+            if current_node.parent is not None:
+                current_node.parent.rank_sub_folder(current_node, leaf_node_folder_stats.size)
             current_node = current_node.parent
 
+    def rank_sub_folder(self, folder, size_delta):
+        """Moves a sub folder whose size changed by size_delta up or out of the ranking"""
+        ranked_folders = self.ranked_folders
+
+        # Rankings are replaced rather than changed in place, so they can be read while the tree changes
+        if folder in ranked_folders:
+            # A sub folder that isn't ranked could now be bigger
+            if size_delta < 0:
+                self.rank_sub_folders()
+            elif size_delta > 0:
+                self._set_ranking(sorted(ranked_folders, key=folder_size, reverse=True))
+        elif len(ranked_folders) < self.ranked_count or folder_size(folder) > folder_size(ranked_folders[-1]):
+            self._set_ranking(sorted([*ranked_folders, folder], key=folder_size, reverse=True)[:self.ranked_count])
+
+    def rank_sub_folders(self):
+        """Ranks every sub folder again, for when the ranking can't be patched"""
+        self._set_ranking(heapq.nlargest(self.ranked_count, self.folders, key=folder_size))
+
+    def _set_ranking(self, ranked_folders):
+        if ranked_folders != self.ranked_folders:
+            self.ranked_folders = ranked_folders
+            self.version += 1
+
+    def top_folders(self, count) -> list:
+        """The count biggest sub folders, biggest first, without changing anything"""
+        if count > self.ranked_count:
+            return heapq.nlargest(count, self.folders, key=folder_size)
+
+        return self.ranked_folders[:count]
+
     def iter_folders(self):
         stack = [sub_folder for sub_folder in self.folders]
 
@@ -42,3 +182,20 @@ class Folder:
         size_gb = self.folder_stats.size / pow(1024, 3)
         date_modified = datetime.utcfromtimestamp(self.folder_stats.last_modified).strftime('%Y-%m-%dTZ')
         return "{modified} - {size:.2f}GB - {name}".format(modified=date_modified, size=size_gb, name=self.path)
+
+
+class SmallFolders(Folder):
+    """
+        Stands in for sub folders that were pruned from the tree for being too small
+        to matter, their sizes still count towards the parent through this folder
+    """
+    def __init__(self, parent: Folder):
+        super().__init__("(0 small folders)", parent, FolderStats(0, 0))
+        self.count = 0
+
+    def add_folder(self, folder: Folder, count):
+        self.count += count
+        self.name = f"({self.count} small folders)"
+
+        self.update_file_stats(FolderStats(self.file_stats.size + folder.folder_stats.size,
+                                           max(self.file_stats.last_modified, folder.folder_stats.last_modified)))
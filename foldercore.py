@@ -1,51 +1,380 @@
 import curses
+import os
 from functools import partial
 from itertools import islice
 from pathlib import Path
 
+from CentralDispatch import CancellationToken
 from folder import Folder, FolderStats
-from printers import start_stop, make_context_menu, print_highlighted_line, print_bold_line, print_line
+from filesinks import FileSinks
+from printers import start_stop, make_context_menu, print_highlighted_line, print_bold_line, print_line, \
+    print_fitting_line
 from ContextUtils import is_hidden
+from diff import EMPTY_STATS, FolderDelta, find_folder, modified_change
+from scanfilter import ScanFilter, VisitedSet, folder_identity
+from scanindex import ScanIndex
 from PrintItem import PrintItem
 
 
-def folder_from_path(path: Path, parent: Folder):
+DIR_FLAGS = os.O_RDONLY | getattr(os, "O_DIRECTORY", 0)
+
+
+def scan_dir(directory, path, scan_filter: ScanFilter = None, sub_folder_ids: dict = None,
+             file_sink: FileSinks = None, cancel_token: CancellationToken = None) -> (FolderStats, [str]):
+    """
+        Lists a directory once with os.scandir, returning the aggregate stats of
+        its entries and the names of the sub folders to recurse into
+        directory can be an open fd, then entries are stat'ed relative to it rather
+        than through their full path, which is only used to check the scan filter
+        When given, sub_folder_ids is filled with each sub folder's (st_dev, st_ino),
+        and every file is offered to file_sink
+        A cancelled cancel_token stops the listing between entries, with TaskCancelled
+    """
     size = 0
     last_modified = 0
+    sub_folder_names = []
 
     try:
-        files = list(path.iterdir())
-        size = sum(file.stat().st_size for file in files)
-        last_modified = max(file.stat().st_mtime for file in files)
-    except (ValueError, PermissionError):
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if cancel_token is not None:
+                    cancel_token.raise_if_cancelled()
+
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    stat = None
+
+                if entry.is_dir():
+                    if scan_filter is None or scan_filter.allows(os.path.join(path, entry.name), stat):
+                        sub_folder_names.append(entry.name)
+
+                        # Windows has no inodes in DirEntry stats, those sub folders go on their parent's device
+                        if sub_folder_ids is not None and stat is not None and stat.st_ino != 0:
+                            sub_folder_ids[entry.name] = (stat.st_dev, stat.st_ino)
+                elif file_sink is not None and stat is not None:
+                    file_sink.offer(path, entry.name, stat)
+
+                if stat is not None:
+                    size += stat.st_size
+                    last_modified = max(last_modified, stat.st_mtime)
+    except OSError:
         pass
 
-    new_folder = Folder(path, parent, FolderStats(size, last_modified))
+    return FolderStats(size, last_modified), sub_folder_names
+
+
+def scan_path(path: Path, scan_filter: ScanFilter = None, sub_folder_ids: dict = None, use_dir_fd=False,
+              file_sink: FileSinks = None, cancel_token: CancellationToken = None) -> (FolderStats, [Path]):
+    """scan_dir for a path, with use_dir_fd its entries are stat'ed relative to an fd of it"""
+    if not use_dir_fd:
+        folder_stats, sub_folder_names = scan_dir(path, path, scan_filter, sub_folder_ids, file_sink, cancel_token)
+    else:
+        try:
+            dir_fd = os.open(path, DIR_FLAGS)
+        except OSError:
+            return FolderStats(0, 0), []
+
+        try:
+            folder_stats, sub_folder_names = scan_dir(dir_fd, path, scan_filter, sub_folder_ids, file_sink,
+                                                      cancel_token)
+        finally:
+            os.close(dir_fd)
+
+    return folder_stats, [path / name for name in sub_folder_names]
+
+
+def cached_scan_path(path: Path, scan_index: ScanIndex, scan_filter: ScanFilter = None, sub_folder_ids: dict = None,
+                     use_dir_fd=False, file_sink: FileSinks = None,
+                     cancel_token: CancellationToken = None) -> (FolderStats, [Path]):
+    """
+        Like scan_path, but reuses the scan index's entry when the directory's
+        inode and mtime are unchanged, storing a fresh scan otherwise
+        The index keeps every sub folder, so cached ones are filtered here, and
+        the folder itself, its stats are None when it's filtered out
+        Only folders that are listed again fill sub_folder_ids and offer their files
+    """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return scan_path(path, scan_filter, sub_folder_ids, use_dir_fd, file_sink, cancel_token)
+
+    # Cached sub folders have no stat yet, so their device and inode are checked
+    # here, once they're stat'ed themselves
+    if scan_filter is not None and not scan_filter.allows(path, stat):
+        return None, []
+
+    cached = scan_index.lookup(path, stat)
+    if cached is None:
+        folder_stats, sub_folder_paths = scan_path(path, sub_folder_ids=sub_folder_ids, use_dir_fd=use_dir_fd,
+                                                   file_sink=file_sink, cancel_token=cancel_token)
+        scan_index.store(path, stat, folder_stats, sub_folder_paths)
+    else:
+        folder_stats, sub_folder_paths = cached
+
+    if scan_filter is not None:
+        sub_folder_paths = [sub_folder_path for sub_folder_path in sub_folder_paths
+                            if scan_filter.allows(sub_folder_path)]
+
+    return folder_stats, sub_folder_paths
+
+
+def scan_folder_stats(path: Path, scan_index: ScanIndex = None, scan_filter: ScanFilter = None,
+                      sub_folder_ids: dict = None, use_dir_fd=False, file_sink: FileSinks = None,
+                      cancel_token: CancellationToken = None) -> (FolderStats, [Path]):
+    if scan_index is None:
+        return scan_path(path, scan_filter, sub_folder_ids, use_dir_fd, file_sink, cancel_token)
+    else:
+        return cached_scan_path(path, scan_index, scan_filter, sub_folder_ids, use_dir_fd, file_sink, cancel_token)
+
+
+def scan_folder(path: Path, parent: Folder, scan_index: ScanIndex = None, make_folder=Folder,
+                scan_filter: ScanFilter = None, sub_folder_ids: dict = None, use_dir_fd=False,
+                file_sink: FileSinks = None, cancel_token: CancellationToken = None) -> (Folder, [Path]):
+    """The folder is None when the scan filter leaves it out, which only cached folders are checked for"""
+    folder_stats, sub_folder_paths = scan_folder_stats(path, scan_index, scan_filter, sub_folder_ids, use_dir_fd,
+                                                       file_sink, cancel_token)
+
+    if folder_stats is None:
+        return None, []
+
+    return make_folder(path, parent, folder_stats), sub_folder_paths
+
+
+def folder_from_path(path: Path, parent: Folder):
+    new_folder, _ = scan_folder(path, parent)
 
     return new_folder
 
 
 def sub_paths(path):
+    _, sub_folder_paths = scan_path(path)
+
+    return sub_folder_paths
+
+
+def scan_subtree(path: Path, cache_filename=None, scan_filter: ScanFilter = None, use_dir_fd=False,
+                 file_sink: FileSinks = None, cancel_token: CancellationToken = None) -> ([tuple], int, int, list):
+    """
+        Scans a whole subtree, returning it as a flat list of
+        (parent_index, name, size, last_modified, folder_id) records in pre-order,
+        how many folders the scan filter skipped and found already visited, and
+        what the subtree's files left in file_sink when it's given
+        Meant to run in a worker process, the records are cheap to send back
+        With a visited set, folder_id is the folder's (st_dev, st_ino), so folders
+        also reached from another worker's subtree can be dropped, None otherwise
+        The root's is None unless it's cached, listing its parent already added it
+        The records are empty when the subtree's root itself is filtered out
+        A cancelled cancel_token stops it between entries, with TaskCancelled
+    """
+    if use_dir_fd and cache_filename is None:
+        records = _scan_subtree_dir_fds(path, scan_filter, file_sink, cancel_token)
+    else:
+        records = _scan_subtree_paths(path, cache_filename, scan_filter, use_dir_fd, file_sink, cancel_token)
+
+    collected = file_sink.collected() if file_sink is not None else None
+
+    if scan_filter is None:
+        return records, 0, 0, collected
+    return records, scan_filter.skipped, scan_filter.revisited, collected
+
+
+def tracks_visited(scan_filter: ScanFilter) -> bool:
+    return scan_filter is not None and scan_filter.visited is not None
+
+
+def _scan_subtree_paths(path: Path, cache_filename, scan_filter: ScanFilter, use_dir_fd,
+                        file_sink: FileSinks, cancel_token: CancellationToken) -> [tuple]:
+    records = []
+    stack = [(-1, path, None)]
+    scan_index = ScanIndex(cache_filename) if cache_filename is not None else None
+    with_ids = tracks_visited(scan_filter)
+
+    while len(stack) > 0:
+        parent_index, folder_path, folder_id = stack.pop()
+        sub_folder_ids = {}
+        folder_stats, sub_folder_paths = scan_folder_stats(folder_path, scan_index, scan_filter, sub_folder_ids,
+                                                           use_dir_fd, file_sink, cancel_token)
+
+        # Already visited, which cached folders are only found to be once they're stat'ed
+        if folder_stats is None:
+            continue
+
+        # Listed sub folders come with their ids, cached ones are stat'ed for them
+        if with_ids and folder_id is None and (parent_index >= 0 or scan_index is not None):
+            stat = folder_identity(folder_path)
+            folder_id = (stat.st_dev, stat.st_ino) if stat is not None else None
+
+        records.append((parent_index, folder_path.name, folder_stats.size, folder_stats.last_modified, folder_id))
+
+        index = len(records) - 1
+        for sub_folder_path in sub_folder_paths:
+            stack.append((index, sub_folder_path, sub_folder_ids.get(sub_folder_path.name)))
+
+    if scan_index is not None:
+        scan_index.close()
+
+    return records
+
+
+def _scan_subtree_dir_fds(path: Path, scan_filter: ScanFilter, file_sink: FileSinks,
+                          cancel_token: CancellationToken) -> [tuple]:
+    """
+        Walks the subtree by name, opening each folder relative to its parent's fd,
+        so no full path is resolved or built past the root. A folder's fd is closed
+        once its last sub folder is opened, so only the folders with sub folders
+        still to go, at most one per level of the walk, hold one open
+    """
+    records = []
+    # Record index of an open folder -> [fd, path, sub folders left to open]
+    open_folders = {}
+    stack = [(-1, str(path))]
+    with_ids = tracks_visited(scan_filter)
+
     try:
-        return [folder for folder in path.iterdir() if folder.is_dir()]
-    except PermissionError:
-        return []
+        while len(stack) > 0:
+            parent_index, name = stack.pop()
+            parent = open_folders.get(parent_index)
+
+            try:
+                dir_fd = os.open(name, DIR_FLAGS, dir_fd=parent[0] if parent is not None else None)
+            except OSError:
+                dir_fd = None
+
+            if parent is None:
+                folder_path = name
+            else:
+                folder_path = os.path.join(parent[1], name)
+
+                parent[2] -= 1
+                if parent[2] == 0:
+                    os.close(parent[0])
+                    del open_folders[parent_index]
+
+            folder_id = None
+            if dir_fd is None:
+                folder_stats, sub_folder_names = FolderStats(0, 0), []
+            else:
+                folder_stats, sub_folder_names = scan_dir(dir_fd, folder_path, scan_filter,
+                                                          file_sink=file_sink, cancel_token=cancel_token)
+
+                if with_ids and parent_index >= 0:
+                    stat = os.fstat(dir_fd)
+                    folder_id = (stat.st_dev, stat.st_ino)
+
+            records.append((parent_index, os.path.basename(name), folder_stats.size, folder_stats.last_modified,
+                            folder_id))
+
+            index = len(records) - 1
+            if len(sub_folder_names) > 0:
+                open_folders[index] = [dir_fd, folder_path, len(sub_folder_names)]
+                for sub_folder_name in sub_folder_names:
+                    stack.append((index, sub_folder_name))
+            elif dir_fd is not None:
+                os.close(dir_fd)
+    finally:
+        for dir_fd, _, _ in open_folders.values():
+            os.close(dir_fd)
+
+    return records
+
+
+def merge_subtree_records(records: [tuple], path: Path, parent: Folder, make_folder=Folder,
+                          defer_rollup=False) -> Folder:
+    """
+        Rebuilds the records from scan_subtree as Folders under parent
+        Parents come before their children, so each folder is inserted into a
+        parent that's already part of the tree
+    """
+    folders = []
+
+    for parent_index, name, size, last_modified, _ in records:
+        if parent_index < 0:
+            folder_parent = parent
+            folder = make_folder(path, folder_parent, FolderStats(size, last_modified))
+        else:
+            # Sub folders only need their name, their paths are rebuilt when they're asked for
+            folder_parent = folders[parent_index]
+            folder = make_folder(name, folder_parent, FolderStats(size, last_modified))
+
+        if defer_rollup:
+            folder_parent.insert_folder_deferred(folder)
+        else:
+            folder_parent.insert_folder(folder)
+        folders.append(folder)
+
+    return folders[0]
+
+
+def drop_visited_records(records: [tuple], visited: VisitedSet) -> ([tuple], int):
+    """
+        Drops the records from scan_subtree of folders already in visited, with
+        everything under them, and adds the rest. Returns the records left, with
+        their parent indexes renumbered, and how many were already visited
+    """
+    kept_records = []
+    # Index in records -> index in kept_records, or None when dropped
+    kept_indexes = []
+    revisited = 0
+
+    for parent_index, name, size, last_modified, folder_id in records:
+        kept_parent_index = kept_indexes[parent_index] if parent_index >= 0 else -1
+
+        if kept_parent_index is None:
+            kept_indexes.append(None)
+            continue
+
+        if folder_id is not None and not visited.add(*folder_id):
+            kept_indexes.append(None)
+            revisited += 1
+            continue
+
+        kept_indexes.append(len(kept_records))
+        kept_records.append((kept_parent_index, name, size, last_modified, folder_id))
+
+    return kept_records, revisited
+
 
+def folder_depth(folder: Folder) -> int:
+    depth = 0
 
-def breadth_first(folder, to_depth) -> [Folder]:
+    while folder.parent is not None:
+        depth += 1
+        folder = folder.parent
+
+    return depth
+
+
+def oldest_biggest_key(folder: Folder) -> tuple:
+    """Oldest first, then shallowest, then biggest"""
+    return folder.folder_stats.last_modified, folder_depth(folder), -folder.folder_stats.size
+
+
+def breadth_first(folder, to_depth, versions: list = None) -> [Folder]:
+    """
+        When given, versions gets the version of every folder whose sub folders
+        were looked at, in order, taken before they were, so the walk is only out
+        of date once one of them goes up
+    """
     collector = []
 
-    _breadth_first(folder, collector, to_depth=to_depth)
+    folder.rollup()
+
+    _breadth_first(folder, collector, to_depth, versions)
 
     return collector
 
 
-def _breadth_first(folder: Folder, collector: [Folder], to_depth, current_depth: int = 0):
+def _breadth_first(folder: Folder, collector: [Folder], to_depth, versions: list, current_depth: int = 0):
     if current_depth <= to_depth:
         collector.append((folder, current_depth))
-        sub_folders = sorted(folder.folders, key=lambda f: f.folder_stats.size, reverse=True)
-        for sub_folder in islice(sub_folders, min(4, len(sub_folders))):
-            _breadth_first(sub_folder, collector, to_depth=to_depth, current_depth=current_depth + 1)
+
+        if current_depth < to_depth:
+            if versions is not None:
+                versions.append(folder.version)
+
+            for sub_folder in folder.top_folders(4):
+                _breadth_first(sub_folder, collector, to_depth, versions, current_depth + 1)
 
 
 def walk_selected_folder_up(folder, visible_folders) -> Folder:
@@ -84,17 +413,35 @@ def _make_folder_tree(context, start, stop):
     for folder, depth in islice(context["folder_data"], start, stop):
         size_gb = folder.folder_stats.size / pow(1024, 3)
 
-        text = "{size:.2f}GB - {name}".format(size=size_gb, name=folder.path)
+        # The longest first, the first that fits the screen is shown
+        texts = ["{size:.2f}GB - {name}".format(size=size_gb, name=folder.path)]
+
+        if context.get("compare_to") is not None:
+            old_folder = find_folder(context["compare_to"], folder.path)
+            old_stats = old_folder.folder_stats if old_folder is not None else EMPTY_STATS
+            delta = FolderDelta(folder.path, old_stats, folder.folder_stats)
+            delta_gb = (folder.folder_stats.size - old_stats.size) / pow(1024, 3)
+
+            texts = ["{size:.2f}GB ({delta:+.2f}GB, {modified}) - {name}".format(size=size_gb, delta=delta_gb,
+                                                                                 modified=modified_change(delta),
+                                                                                 name=folder.path),
+                     "{size:.2f}GB ({delta:+.2f}GB) - {name}".format(size=size_gb, delta=delta_gb, name=folder.path)]
+
+        reclaimable = context.get("reclaimable", {}).get(str(folder.path), 0)
+        if reclaimable > 0:
+            texts = [text + " ({reclaimable:.2f}GB duplicated)".format(reclaimable=reclaimable / pow(1024, 3))
+                     for text in texts]
+
         if folder == context["selected_folder"]:
             if is_hidden(context["context_menu"]):
-                screen_lines.append(partial(print_highlighted_line, depth * 2, text))
+                screen_lines.append(partial(print_fitting_line, print_highlighted_line, depth * 2, texts))
             else:
-                screen_lines.append(partial(print_bold_line, depth * 2, text))
+                screen_lines.append(partial(print_fitting_line, print_bold_line, depth * 2, texts))
 
                 context["context_menu"]["x"] = depth * 2
                 context_menu = make_context_menu(context["context_menu"])
                 screen_lines += context_menu
         else:
-            screen_lines.append(partial(print_line, depth * 2, text))
+            screen_lines.append(partial(print_fitting_line, print_line, depth * 2, texts))
     return screen_lines
 
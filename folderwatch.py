@@ -0,0 +1,124 @@
+from loguru import logger
+
+from folder import Folder
+from foldercore import scan_path, scan_subtree, merge_subtree_records
+from inotify import Inotify, WatchLimitReached, IN_CREATE, IN_DELETE, IN_MODIFY, IN_CLOSE_WRITE, IN_MOVED_FROM, \
+    IN_MOVED_TO, IN_ATTRIB, IN_ONLYDIR, IN_ISDIR, IN_IGNORED, IN_Q_OVERFLOW
+
+WATCH_MASK = IN_CREATE | IN_DELETE | IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_ATTRIB | IN_ONLYDIR
+
+
+class FolderWatcher:
+    """
+        Keeps a scanned Folder tree current by applying inotify events to it
+        Events are applied on dispatch_queue, which must be the serial queue that
+        owns the tree, so they never race with the scan inserting folders
+    """
+    def __init__(self, dispatch_queue, make_folder=Folder, defer_rollup=False, scan_filter=None):
+        self.inotify = Inotify()
+        self.dispatch_queue = dispatch_queue
+        self.make_folder = make_folder
+        self.defer_rollup = defer_rollup
+        self.scan_filter = scan_filter
+        self.folders_by_watch = {}
+        self.watches_by_folder = {}
+        self.watch_limit_reached = False
+        self.stopped = False
+
+    def watch(self, folder: Folder):
+        if self.watch_limit_reached:
+            return
+
+        try:
+            wd = self.inotify.add_watch(folder.path, WATCH_MASK)
+        except WatchLimitReached as e:
+            self.watch_limit_reached = True
+            logger.warning(f"{e}, only the first {len(self.folders_by_watch)} folders will update live")
+            return
+        except OSError:
+            return
+
+        self.folders_by_watch[wd] = folder
+        self.watches_by_folder[folder] = wd
+
+    def watch_tree(self, folder: Folder):
+        self.watch(folder)
+        for sub_folder in folder.iter_folders():
+            self.watch(sub_folder)
+
+    def unwatch_tree(self, folder: Folder):
+        for watched_folder in [folder, *folder.iter_folders()]:
+            wd = self.watches_by_folder.pop(watched_folder, None)
+            if wd is not None:
+                del self.folders_by_watch[wd]
+                self.inotify.remove_watch(wd)
+
+    def stop(self):
+        """Stops run, which closes every watch, once its current read times out"""
+        self.stopped = True
+
+    def run(self, shutdown_signal):
+        while not (shutdown_signal.done() or self.stopped):
+            events = self.inotify.read_events(timeout=0.5)
+            if len(events) > 0:
+                self.dispatch_queue.submit_async(self.apply_events, events)
+
+        self.inotify.close()
+
+    def apply_events(self, events):
+        # Several events often hit the same folder, it only needs recounting once
+        changed_folders = {}
+
+        for event in events:
+            if event.mask & IN_Q_OVERFLOW:
+                logger.warning("inotify queue overflowed, some changes were missed")
+                continue
+
+            folder = self.folders_by_watch.get(event.wd)
+            if folder is None:
+                continue
+
+            if event.mask & IN_IGNORED:
+                del self.folders_by_watch[event.wd]
+                del self.watches_by_folder[folder]
+                continue
+
+            if event.mask & IN_ISDIR:
+                if event.mask & (IN_CREATE | IN_MOVED_TO):
+                    self._add_sub_folder(folder, event.name)
+                elif event.mask & (IN_DELETE | IN_MOVED_FROM):
+                    self._remove_sub_folder(folder, event.name)
+
+            changed_folders[folder] = None
+
+        for folder in changed_folders:
+            # Folders removed by an earlier event are no longer watched, or part of the tree
+            if folder in self.watches_by_folder:
+                folder_stats, _ = scan_path(folder.path)
+                folder.update_file_stats(folder_stats)
+
+    def _find_sub_folder(self, folder: Folder, name):
+        for sub_folder in folder.folders:
+            if sub_folder.name == name:
+                return sub_folder
+
+        return None
+
+    def _add_sub_folder(self, folder: Folder, name):
+        path = folder.path / name
+
+        if self._find_sub_folder(folder, name) is not None:
+            return
+        if self.scan_filter is not None and not self.scan_filter.allows(path):
+            return
+
+        records, _, _, _ = scan_subtree(path, scan_filter=self.scan_filter)
+        new_folder = merge_subtree_records(records, path, folder, self.make_folder, self.defer_rollup)
+        self.watch_tree(new_folder)
+
+    def _remove_sub_folder(self, folder: Folder, name):
+        sub_folder = self._find_sub_folder(folder, name)
+
+        if sub_folder is not None:
+            self.unwatch_tree(sub_folder)
+            folder.remove_folder(sub_folder)
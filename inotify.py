@@ -0,0 +1,93 @@
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import struct
+from collections import namedtuple
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+
+# struct inotify_event {int wd; uint32_t mask; uint32_t cookie; uint32_t len; char name[];}
+EVENT_HEADER = struct.Struct("iIII")
+
+InotifyEvent = namedtuple("InotifyEvent", ["wd", "mask", "cookie", "name"])
+
+
+class InotifyUnavailable(Exception): pass
+
+
+class WatchLimitReached(Exception): pass
+
+
+class Inotify:
+    """
+        Minimal ctypes wrapper around the Linux inotify API
+    """
+    def __init__(self):
+        libc_name = ctypes.util.find_library("c")
+        if libc_name is None:
+            raise InotifyUnavailable("Couldn't find libc")
+
+        self.libc = ctypes.CDLL(libc_name, use_errno=True)
+        if not hasattr(self.libc, "inotify_init1"):
+            raise InotifyUnavailable("libc doesn't support inotify")
+
+        self.libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self.libc.inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+
+        self.fd = self.libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise InotifyUnavailable(os.strerror(ctypes.get_errno()))
+
+    def add_watch(self, path, mask) -> int:
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), mask)
+
+        if wd < 0:
+            error = ctypes.get_errno()
+            if error == errno.ENOSPC:
+                raise WatchLimitReached(f"Couldn't watch {path}, fs.inotify.max_user_watches reached")
+            raise OSError(error, os.strerror(error), str(path))
+
+        return wd
+
+    def remove_watch(self, wd):
+        self.libc.inotify_rm_watch(self.fd, wd)
+
+    def read_events(self, timeout) -> [InotifyEvent]:
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if len(readable) == 0:
+            return []
+
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+
+        events = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, cookie, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+
+            name = data[offset:offset + length].rstrip(b"\0")
+            offset += length
+
+            events.append(InotifyEvent(wd, mask, cookie, os.fsdecode(name)))
+
+        return events
+
+    def close(self):
+        os.close(self.fd)
@@ -0,0 +1,87 @@
+import heapq
+import itertools
+import threading
+from collections import namedtuple
+from datetime import datetime
+from pathlib import Path
+
+
+class LargeFile(namedtuple("LargeFile", ["path", "size", "last_modified"])):
+    def __str__(self):
+        size_gb = self.size / pow(1024, 3)
+        date_modified = datetime.utcfromtimestamp(self.last_modified).strftime('%Y-%m-%dTZ')
+        return "{modified} - {size:.2f}GB - {name}".format(modified=date_modified, size=size_gb, name=self.path)
+
+
+class LargestFiles:
+    """
+        The n largest files seen by the scan, from the stats it already takes
+        Each worker thread offers files to a min-heap of its own, so it never
+        waits on a lock, and the heaps are merged whenever they're read. Paths
+        are only built for the files that make it into the merged result
+    """
+    def __init__(self, n):
+        self.n = n
+        self.lock = threading.Lock()
+        self.thread_heaps = threading.local()
+        self.heaps = []
+        self.tie_breaker = itertools.count()
+
+    def _thread_heap(self) -> list:
+        heap = getattr(self.thread_heaps, "heap", None)
+
+        if heap is None:
+            heap = []
+            self.thread_heaps.heap = heap
+            with self.lock:
+                self.heaps.append(heap)
+
+        return heap
+
+    def offer(self, folder_path, name, stat):
+        heap = self._thread_heap()
+        size = stat.st_size
+
+        # heapq's functions run without releasing the GIL, so items() always copies a whole heap
+        if len(heap) < self.n:
+            heapq.heappush(heap, (size, next(self.tie_breaker), stat.st_mtime, folder_path, name))
+        elif size > heap[0][0]:
+            heapq.heapreplace(heap, (size, next(self.tie_breaker), stat.st_mtime, folder_path, name))
+
+    def collected(self) -> [LargeFile]:
+        return self.items()
+
+    def add_collected(self, large_files: [LargeFile]):
+        """Merges in files found elsewhere, like in a worker process"""
+        heap = self._thread_heap()
+
+        for large_file in large_files:
+            entry = (large_file.size, next(self.tie_breaker), large_file.last_modified,
+                     large_file.path.parent, large_file.path.name)
+
+            if len(heap) < self.n:
+                heapq.heappush(heap, entry)
+            elif large_file.size > heap[0][0]:
+                heapq.heapreplace(heap, entry)
+
+    def items(self) -> [LargeFile]:
+        """Largest first"""
+        with self.lock:
+            heaps = list(self.heaps)
+
+        entries = heapq.nlargest(self.n, itertools.chain.from_iterable(list(heap) for heap in heaps))
+
+        return [LargeFile(Path(folder_path, name), size, last_modified)
+                for size, _, last_modified, folder_path, name in entries]
+
+    def clear(self):
+        with self.lock:
+            self.thread_heaps = threading.local()
+            self.heaps = []
+
+    # Thread locals and locks can't be pickled, worker processes start empty
+    def __getstate__(self):
+        return {"n": self.n}
+
+    def __setstate__(self, state):
+        self.__init__(state["n"])
@@ -1,49 +1,108 @@
 # Usage: python3 main.py PATH_TO_ANALYZE -s MIN_SIZE_GB
 
 import argparse
+import sys
 from curses import wrapper
 from functools import partial
-from pathlib import Path
 
 from activities.FolderScanActivity import FolderScanActivity
 from FolderScanApp import FolderScanApp
-from folder import Folder
+from reports import report_formats
 
 
 def main(args, stdscr):
     try:
         app = FolderScanApp(args, stdscr)
+        app.install_rate_signals()
         app.start(FolderScanActivity())
     except Exception as e:
         print("They got through!")
 
 
-def print_final_output(root_folder: Folder, root_path: Path):
-    all_folders = list(root_folder.iter_folders())
+def headless(args):
+    output = sys.stdout if args.output is None else open(args.output, "w", newline="")
+    # The ranked summary goes wherever the streamed rows don't
+    summary = sys.stderr if args.output is None else sys.stdout
 
-    threshold = args.min_size_gb * pow(1024, 3)  # 1GB
-    over_threshold = [f for f in all_folders if f.folder_stats.size > threshold]
-
-    over_threshold.sort(key=lambda f: f.folder_stats.size, reverse=True)
-    over_threshold.sort(key=lambda f: depth(f.path, root_path), reverse=False)
-    over_threshold.sort(key=lambda f: f.folder_stats.last_modified, reverse=False)
-
-    for folder in over_threshold[:30]:
-        print(folder)
-
-
-def depth(path: Path, root: Path):
-    return len(path.relative_to(root).parts)
+    try:
+        report = report_formats[args.format](output, args.min_size_gb * pow(1024, 3), summary)
+        app = FolderScanApp(args, None)
+        app.install_rate_signals()
+        app.run_headless(report)
+    finally:
+        if output is not sys.stdout:
+            output.close()
 
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Disk Usage')
-    parser.add_argument("path", help="The path to analyze")
+    parser.add_argument("path", nargs="?", default=None, help="The path to analyze")
     parser.add_argument("-s", "--min_size_gb", dest="min_size_gb", default=1, type=int, help="The smallest folder to report")
+    parser.add_argument("--largest-files", dest="largest_files", default=30, type=int,
+                        help="How many of the largest files to keep track of, 0 to turn it off")
+    parser.add_argument("--duplicates", dest="duplicates", action="store_true",
+                        help="Once the scan is done, find identical files and show how much each folder could reclaim")
+    parser.add_argument("--duplicates-min-size", dest="duplicates_min_size", default=1, type=float,
+                        help="Smallest file in MB to look for duplicates of")
+    parser.add_argument("--read-bandwidth", dest="read_bandwidth", default=None, type=float,
+                        help="Most MB per second to read while hashing files for duplicates")
+    parser.add_argument("-w", "--workers", dest="workers", default=None, type=int,
+                        help="How many folders to scan at once, tuned while scanning when not given")
+    parser.add_argument("--device-scheduling", dest="device_scheduling", default="auto", choices=["auto", "off"],
+                        help="Give each file system its own workers, scanning spinning disks one folder at a time "
+                             "in inode order, or share one set of workers between them all")
+    parser.add_argument("--priority-scheduling", dest="priority_scheduling", default="auto", choices=["auto", "off"],
+                        help="Scan sub folders of the selected folder, the folders on screen and the biggest folders "
+                             "first, re-ranked when the selection or the folders on screen change, or scan in inode order")
+    parser.add_argument("--max-rate", dest="max_rate", default=None, type=float,
+                        help="Most folders to list per second, backing off further when the disk slows down. "
+                             "Change it while scanning with +/- or SIGUSR2/SIGUSR1")
+    parser.add_argument("--processes", dest="processes", action="store_true",
+                        help="Scan top level folders in worker processes instead of threads")
+    parser.add_argument("--dir-fd", dest="dir_fd", action="store_true",
+                        help="Stat entries relative to an open fd of their folder, and with --processes walk "
+                             "whole subtrees by folder name, instead of resolving every full path")
+    parser.add_argument("--cache", dest="cache", default=None,
+                        help="Scan index file, unchanged folders are reused from it instead of rescanned")
+    parser.add_argument("--watch", dest="watch", action="store_true",
+                        help="Keep the tree up to date with inotify once folders are scanned (Linux only)")
+    parser.add_argument("--compact-tree", dest="compact_tree", action="store_true",
+                        help="Keep the folder tree in flat arrays, uses far less memory on huge trees")
+    parser.add_argument("--deferred-rollup", dest="deferred_rollup", action="store_true",
+                        help="Only total up folder sizes when they're displayed, instead of on every insert")
+    parser.add_argument("--batch-size", dest="batch_size", default=256, type=int,
+                        help="How many scanned folders each worker hands over to be merged at once")
+    parser.add_argument("--max-pending-merges", dest="max_pending_merges", default=64, type=int,
+                        help="Most batches of scanned folders waiting to be merged before workers wait for them, "
+                             "0 for no limit")
+    parser.add_argument("-x", "--exclude", dest="exclude", action="append", default=[],
+                        help="Skip folders matching this glob, or regex when prefixed with 're:', can be repeated")
+    parser.add_argument("--one-file-system", dest="one_file_system", action="store_true",
+                        help="Don't descend into folders on other file systems")
+    parser.add_argument("--visited", dest="visited", default="exact", choices=["exact", "compact", "off"],
+                        help="How folders already scanned through a bind mount or symlink are remembered, "
+                             "compact uses less memory on huge trees")
+    parser.add_argument("--prune", dest="prune", default=None, type=float,
+                        help="Collapse finished folders smaller than this fraction of the minimum size, to bound memory")
+    parser.add_argument("--save", dest="save", default=None, help="Save the finished scan to a snapshot file")
+    parser.add_argument("--open", dest="open", default=None, help="Open a saved snapshot instead of scanning a path")
+    parser.add_argument("--diff", dest="diff", default=None,
+                        help="Snapshot to compare against, shows how much each folder grew since")
+    parser.add_argument("--headless", dest="headless", action="store_true",
+                        help="Scan without the UI, streaming folders as they finish and printing a report at the end")
+    parser.add_argument("--format", dest="format", default="jsonl", choices=sorted(report_formats),
+                        help="Format of the streamed folders in headless mode")
+    parser.add_argument("-o", "--output", dest="output", default=None,
+                        help="File to stream folders to in headless mode, instead of stdout")
 
     args = parser.parse_args()
 
-    # main(args, None)
-    wrapper(partial(main, args))
+    if args.path is None and args.open is None:
+        parser.error("either a path to analyze or --open is required")
+
+    if args.headless:
+        headless(args)
+    else:
+        wrapper(partial(main, args))
 
 
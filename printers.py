@@ -23,6 +23,13 @@ def print_bold_line(x, text, screen, y):
     screen.addstr(y, x, text, curses.A_BOLD)
 
 
+def print_fitting_line(print_text, x, texts, screen, y):
+    """Prints the first of texts that fits in the screen's width with print_text, or the last one if none do"""
+    num_rows, num_cols = screen.getmaxyx()
+    text = next((text for text in texts if x + len(text) < num_cols), texts[-1])
+    print_text(x, text, screen, y)
+
+
 def make_top_bar(context, remaining_height):
     def print_top_bar(screen, y):
         items = [text for key, text in context["items"].items()]
@@ -0,0 +1,89 @@
+import threading
+import time
+
+from loguru import logger
+
+
+class RateLimiter:
+    """
+        A token bucket shared by every worker, scan workers take a token per folder
+        listing, and the duplicate finder one per byte read
+        Without a rate it never waits. With one, it also backs off when recorded
+        latencies rise to more than twice what they normally are, which is what
+        a disk that's busy serving something else looks like
+    """
+    def __init__(self, rate=None, adjust_interval=0.5, min_latency=0.002, label="Scan rate", unit="folders/s"):
+        self.lock = threading.Lock()
+        self.rate = rate
+        self.label = label
+        self.unit = unit
+        self.tokens = 0.0
+        self.refilled = time.monotonic()
+        self.adjust_interval = adjust_interval
+        # Listings faster than this come from the page cache, they don't load the disk
+        self.min_latency = min_latency
+        self.adjusted = time.monotonic()
+        self.backoff = 1.0
+        self.latency = None
+        self.baseline = None
+
+    def effective_rate(self) -> float:
+        return self.rate * self.backoff
+
+    def set_rate(self, rate):
+        with self.lock:
+            self._refill(time.monotonic())
+            self.rate = rate
+
+        logger.info(f"{self.label}: {'unlimited' if rate is None else f'{rate:.0f} {self.unit}'}")
+
+    def acquire(self, tokens=1):
+        """
+            Waits for a token, then takes tokens, which can leave the bucket owing
+            some when they're more than it holds, later callers wait that off
+        """
+        while self.rate is not None:
+            with self.lock:
+                if self.rate is None:
+                    return
+
+                self._refill(time.monotonic())
+                if self.tokens >= 1:
+                    self.tokens -= tokens
+                    return
+
+                wait = (1 - self.tokens) / self.effective_rate()
+
+            time.sleep(wait)
+
+    def _refill(self, now):
+        if self.rate is not None:
+            # At most a second's worth of tokens, so an idle spell isn't followed by a burst
+            rate = self.effective_rate()
+            self.tokens = min(max(1.0, rate), self.tokens + (now - self.refilled) * rate)
+
+        self.refilled = now
+
+    def record_latency(self, latency):
+        with self.lock:
+            self.latency = latency if self.latency is None else self.latency * 0.8 + latency * 0.2
+            slow = self.latency > max(2 * self.baseline, self.min_latency) if self.baseline is not None else False
+
+            # The baseline is a long running average of normal listings, slow ones don't count
+            if self.baseline is None:
+                self.baseline = latency
+            elif not slow:
+                self.baseline = self.baseline * 0.98 + latency * 0.02
+
+            now = time.monotonic()
+            if self.rate is None or now - self.adjusted < self.adjust_interval:
+                return
+            self.adjusted = now
+
+            if slow:
+                if self.backoff == 1.0:
+                    logger.info(f"{self.label} backing off, listings take {self.latency * 1000:.1f}ms "
+                                f"against {self.baseline * 1000:.1f}ms normally")
+                self.backoff = max(0.05, self.backoff / 2)
+            else:
+                self.backoff = min(1.0, self.backoff + 0.1)
@@ -0,0 +1,88 @@
+import csv
+import json
+import sys
+
+from diff import FolderDelta, size_delta, modified_change
+from duplicates import DuplicateGroup, reclaimable
+from folder import Folder
+from largestfiles import LargeFile
+
+
+def print_final_output(oldest_biggest: [Folder], file=sys.stdout):
+    for folder in oldest_biggest:
+        print(folder, file=file)
+
+
+def print_largest_files(largest_files: [LargeFile], file=sys.stdout):
+    for large_file in largest_files:
+        print(large_file, file=file)
+
+
+def print_duplicates(duplicates: [DuplicateGroup], file=sys.stdout):
+    for group in duplicates:
+        reclaimable_gb = reclaimable(group) / pow(1024, 3)
+        print("{reclaimable:.2f}GB - {count} copies - {name}".format(reclaimable=reclaimable_gb, count=len(group.paths),
+                                                                   name=", ".join(str(path) for path in group.paths)),
+              file=file)
+
+
+def print_growth(growth: [FolderDelta], file=sys.stdout):
+    for delta in growth:
+        size_gb = delta.new_stats.size / pow(1024, 3)
+        delta_gb = size_delta(delta) / pow(1024, 3)
+        print("{delta:+.2f}GB - {size:.2f}GB - {modified} - {name}".format(delta=delta_gb, size=size_gb,
+                                                                           modified=modified_change(delta),
+                                                                           name=delta.path),
+              file=file)
+
+
+class FolderReport:
+    """
+        Streams folders as their subtrees finish scanning, only folders of at
+        least min_size bytes are written, then prints the oldest biggest at the end
+    """
+    def __init__(self, stream, min_size, summary_stream=sys.stderr):
+        self.stream = stream
+        self.min_size = min_size
+        self.summary_stream = summary_stream
+
+    def write_folder(self, folder: Folder):
+        if folder.folder_stats.size >= self.min_size:
+            self.write_row(str(folder.path), folder.folder_stats.size, folder.folder_stats.last_modified)
+            self.stream.flush()
+
+    def write_row(self, path, size, last_modified): pass
+
+    def finish(self, oldest_biggest: [Folder], growth: [FolderDelta] = None, largest_files: [LargeFile] = (),
+               duplicates: [DuplicateGroup] = None):
+        print_final_output(oldest_biggest, file=self.summary_stream)
+
+        if len(largest_files) > 0:
+            print("\nLargest files:", file=self.summary_stream)
+            print_largest_files(largest_files, file=self.summary_stream)
+
+        if duplicates is not None:
+            print("\nDuplicated the most:", file=self.summary_stream)
+            print_duplicates(duplicates[:30], file=self.summary_stream)
+
+        if growth is not None:
+            print("\nGrew the most:", file=self.summary_stream)
+            print_growth(growth, file=self.summary_stream)
+
+
+class JsonLinesReport(FolderReport):
+    def write_row(self, path, size, last_modified):
+        self.stream.write(json.dumps({"path": path, "size": size, "last_modified": last_modified}) + "\n")
+
+
+class CsvReport(FolderReport):
+    def __init__(self, stream, min_size, summary_stream=sys.stderr):
+        super().__init__(stream, min_size, summary_stream)
+        self.writer = csv.writer(stream)
+        self.writer.writerow(["path", "size", "last_modified"])
+
+    def write_row(self, path, size, last_modified):
+        self.writer.writerow([path, size, last_modified])
+
+
+report_formats = {"jsonl": JsonLinesReport, "csv": CsvReport}
@@ -0,0 +1,228 @@
+import bisect
+import fnmatch
+import os
+import re
+import threading
+from array import array
+from pathlib import Path
+
+
+def translate_name_glob(rule: str) -> str:
+    """Like fnmatch.translate, but * and ? stop at a "/", so the glob only ever matches one name"""
+    parts = []
+    index = 0
+
+    while index < len(rule):
+        char = rule[index]
+        index += 1
+
+        if char == "*":
+            parts.append("[^/]*")
+        elif char == "?":
+            parts.append("[^/]")
+        elif char == "[":
+            # A "]" straight after the "[" or "[!" is part of the set, not its end
+            end = index
+            if end < len(rule) and rule[end] == "!":
+                end += 1
+            if end < len(rule) and rule[end] == "]":
+                end += 1
+            end = rule.find("]", end)
+
+            if end < 0:
+                parts.append(re.escape(char))
+                continue
+
+            chars = rule[index:end].replace("\\", "\\\\")
+            index = end + 1
+
+            if chars.startswith("!"):
+                parts.append("[^/" + chars[1:] + "]")
+            elif chars.startswith("^"):
+                parts.append("[\\" + chars + "]")
+            else:
+                parts.append("[" + chars + "]")
+        else:
+            parts.append(re.escape(char))
+
+    return "(?s:" + "".join(parts) + ")\\Z"
+
+
+def compile_exclude_rules(rules: [str]):
+    """
+        Compiles every rule into a single regex, matched against a folder's full path
+        Rules starting with "re:" are regexes that can match anywhere in the path,
+        globs containing a "/" match the full path, and other globs match the name
+    """
+    patterns = []
+
+    for rule in rules:
+        if rule.startswith("re:"):
+            patterns.append(".*?(?:" + rule[len("re:"):] + ")")
+        elif "/" in rule:
+            patterns.append(fnmatch.translate(rule.rstrip("/")))
+        else:
+            patterns.append("(?:.*/)?" + translate_name_glob(rule))
+
+    if len(patterns) == 0:
+        return None
+
+    return re.compile("|".join(f"(?:{pattern})" for pattern in patterns))
+
+
+class VisitedSet:
+    """
+        The (st_dev, st_ino) of every folder the scan has descended into, so bind
+        mounts, hard linked folders and symlink loops are only scanned once
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.visited = set()
+
+    def add(self, device, inode) -> bool:
+        """Adds the folder, returning False if it was already visited"""
+        key = (device, inode)
+
+        with self.lock:
+            if key in self.visited:
+                return False
+
+            self.visited.add(key)
+            return True
+
+    def __len__(self):
+        return len(self.visited)
+
+    # The lock can't be pickled, worker processes get their own
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        del state["lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+
+
+def merge_sorted_inodes(sorted_inodes: array, new_inodes: [int]) -> array:
+    """
+        Merges sorted new_inodes into a copy of the sorted_inodes array, the runs of
+        old inodes in between new ones are copied as array slices, so it never makes
+        a list of the whole array
+    """
+    merged = array("Q")
+    start = 0
+
+    for inode in new_inodes:
+        end = bisect.bisect_left(sorted_inodes, inode, start)
+        merged.extend(sorted_inodes[start:end])
+        merged.append(inode)
+        start = end
+
+    merged.extend(sorted_inodes[start:])
+
+    return merged
+
+
+class CompactVisitedSet(VisitedSet):
+    """
+        VisitedSet for huge trees, inodes are kept in a sorted array per device at
+        8 bytes each, new ones go to a small set that's merged in once it grows to
+        a fraction of the array, so merges stay rare as the array grows
+    """
+    def __init__(self):
+        super().__init__()
+        self.sorted_inodes = {}
+        self.recent_inodes = {}
+
+    def add(self, device, inode) -> bool:
+        with self.lock:
+            sorted_inodes = self.sorted_inodes.setdefault(device, array("Q"))
+            recent_inodes = self.recent_inodes.setdefault(device, set())
+
+            if inode in recent_inodes:
+                return False
+
+            index = bisect.bisect_left(sorted_inodes, inode)
+            if index < len(sorted_inodes) and sorted_inodes[index] == inode:
+                return False
+
+            recent_inodes.add(inode)
+            if len(recent_inodes) >= max(4096, len(sorted_inodes) // 8):
+                self.sorted_inodes[device] = merge_sorted_inodes(sorted_inodes, sorted(recent_inodes))
+                recent_inodes.clear()
+
+            return True
+
+    def __len__(self):
+        return sum(len(inodes) for inodes in self.sorted_inodes.values()) + \
+            sum(len(inodes) for inodes in self.recent_inodes.values())
+
+
+def folder_identity(path) -> os.stat_result:
+    """
+        A stat of path with a real st_dev and st_ino, or None where there's none
+        DirEntry.stat() leaves both at 0 on Windows, os.stat fills them in
+    """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+
+    # Without inodes every folder would look like the same one
+    return stat if stat.st_ino != 0 else None
+
+
+class ScanFilter:
+    """
+        Decides which sub folders the scan descends into, before they're listed
+        With a root device set, folders on other file systems are skipped too, and
+        with a visited set, folders that were already scanned through another path
+        Neither is checked for folders whose device and inode can't be found
+    """
+    def __init__(self, exclude_rules: [str] = (), root_device=None, visited: VisitedSet = None):
+        self.matcher = compile_exclude_rules(exclude_rules)
+        self.root_device = root_device
+        self.visited = visited
+        self.skipped = 0
+        self.revisited = 0
+        self.lock = threading.Lock()
+
+    def allows(self, path, stat: os.stat_result = None) -> bool:
+        """path is a Path, or a str when the scan only has folder names and builds their paths as strings"""
+        if stat is not None and stat.st_ino == 0 and (self.root_device is not None or self.visited is not None):
+            stat = folder_identity(path)
+
+        if self.matcher is not None and isinstance(path, Path):
+            path = path.as_posix()
+        excluded = self.matcher is not None and self.matcher.match(path) is not None
+        other_device = self.root_device is not None and stat is not None and stat.st_dev != self.root_device
+
+        if excluded or other_device:
+            self.add_skipped(1)
+            return False
+
+        if self.visited is not None and stat is not None and not self.visited.add(stat.st_dev, stat.st_ino):
+            self.add_revisited(1)
+            return False
+
+        return True
+
+    def add_skipped(self, count):
+        with self.lock:
+            self.skipped += count
+
+    def add_revisited(self, count):
+        with self.lock:
+            self.revisited += count
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        del state["lock"]
+        state["skipped"] = 0
+        state["revisited"] = 0
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
@@ -0,0 +1,72 @@
+import os
+import sqlite3
+import threading
+from pathlib import Path
+
+from folder import FolderStats
+
+
+class ScanIndex:
+    """
+        On disk index of previous scans, keyed by directory path
+        A directory whose inode and mtime haven't changed since it was stored reuses
+        its stored stats and sub folders instead of being listed again
+        Editing a file in place doesn't change its directory's mtime, so those
+        size changes are only picked up once something else touches the directory
+    """
+    def __init__(self, filename, batch_size=1000):
+        self.connection = sqlite3.connect(str(filename), timeout=60, check_same_thread=False)
+        self.lock = threading.Lock()
+        self.batch_size = batch_size
+        self.pending_rows = []
+
+        with self.lock:
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute("CREATE TABLE IF NOT EXISTS folders ("
+                                    "path TEXT PRIMARY KEY, "
+                                    "inode INTEGER, "
+                                    "mtime_ns INTEGER, "
+                                    "size INTEGER, "
+                                    "last_modified REAL, "
+                                    "children TEXT)")
+            self.connection.commit()
+
+    def lookup(self, path: Path, stat: os.stat_result) -> (FolderStats, [Path]):
+        with self.lock:
+            row = self.connection.execute("SELECT inode, mtime_ns, size, last_modified, children "
+                                          "FROM folders WHERE path = ?", (str(path),)).fetchone()
+
+        if row is None:
+            return None
+
+        inode, mtime_ns, size, last_modified, children = row
+        if inode != stat.st_ino or mtime_ns != stat.st_mtime_ns:
+            return None
+
+        sub_folder_paths = [path / name for name in children.split("\0") if name != ""]
+
+        return FolderStats(size, last_modified), sub_folder_paths
+
+    def store(self, path: Path, stat: os.stat_result, folder_stats: FolderStats, sub_folder_paths: [Path]):
+        children = "\0".join(sub_folder_path.name for sub_folder_path in sub_folder_paths)
+        row = (str(path), stat.st_ino, stat.st_mtime_ns, folder_stats.size, folder_stats.last_modified, children)
+
+        with self.lock:
+            self.pending_rows.append(row)
+
+            if len(self.pending_rows) >= self.batch_size:
+                self._flush()
+
+    def _flush(self):
+        self.connection.executemany("INSERT OR REPLACE INTO folders VALUES (?, ?, ?, ?, ?, ?)", self.pending_rows)
+        self.connection.commit()
+        self.pending_rows = []
+
+    def flush(self):
+        with self.lock:
+            self._flush()
+
+    def close(self):
+        with self.lock:
+            self._flush()
+            self.connection.close()
@@ -0,0 +1,197 @@
+import heapq
+import mmap
+import os
+import struct
+from collections import deque
+from pathlib import Path
+
+from folder import Folder, FolderStats
+
+MAGIC = b"DUSNAP01"
+
+# magic, node count, records offset, string table offset, string table size, ranked offset, ranked count
+HEADER = struct.Struct("<8sqqqqqq")
+# parent, first child, child count, size, last modified, name offset, name length
+RECORD = struct.Struct("<qqqqdqq")
+RANKED = struct.Struct("<q")
+
+NO_FOLDER = -1
+
+
+class SnapshotError(Exception): pass
+
+
+def save_snapshot(root_folder: Folder, filename, ranked_folders: [Folder] = ()):
+    """
+        Writes the tree as fixed width records followed by a string table
+        Records are in breadth first order with each folder's children next to
+        each other and sorted by name, so a folder only needs its first child and
+        a count, and two snapshots can be compared by walking them in path order
+    """
+    root_folder.rollup()
+
+    string_table = bytearray()
+    ranked_folders = list(ranked_folders)
+    ranked_set = set(ranked_folders)
+    ranked_indexes = {}
+
+    with open(filename, "wb") as snapshot_file:
+        snapshot_file.write(HEADER.pack(MAGIC, 0, HEADER.size, 0, 0, 0, 0))
+
+        queue = deque([(root_folder, NO_FOLDER, str(root_folder.path))])
+        index = 0
+        next_index = 1
+
+        while len(queue) > 0:
+            folder, parent_index, name = queue.popleft()
+
+            if folder in ranked_set:
+                ranked_indexes[folder] = index
+
+            sub_folders = sorted(folder.folders, key=lambda sub_folder: sub_folder.name)
+            encoded_name = os.fsencode(name)
+
+            snapshot_file.write(RECORD.pack(parent_index, next_index, len(sub_folders),
+                                            folder.folder_stats.size, folder.folder_stats.last_modified,
+                                            len(string_table), len(encoded_name)))
+            string_table += encoded_name
+
+            for sub_folder in sub_folders:
+                queue.append((sub_folder, index, sub_folder.name))
+            next_index += len(sub_folders)
+            index += 1
+
+        string_table_offset = snapshot_file.tell()
+        snapshot_file.write(string_table)
+
+        ranked_offset = snapshot_file.tell()
+        ranked = [ranked_indexes[folder] for folder in ranked_folders if folder in ranked_indexes]
+        for ranked_index in ranked:
+            snapshot_file.write(RANKED.pack(ranked_index))
+
+        snapshot_file.seek(0)
+        snapshot_file.write(HEADER.pack(MAGIC, index, HEADER.size, string_table_offset, len(string_table),
+                                        ranked_offset, len(ranked)))
+
+
+class Snapshot:
+    """
+        A saved scan, memory mapped so only the records that are looked at get read
+        SnapshotFolder gives a read only, Folder compatible view of its records
+    """
+    def __init__(self, filename):
+        self.file = open(filename, "rb")
+        self.mm = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, self.node_count, self.records_offset, self.string_table_offset, _, \
+            self.ranked_offset, self.ranked_count = HEADER.unpack_from(self.mm, 0)
+
+        if magic != MAGIC:
+            raise SnapshotError(f"{filename} isn't a disk usage snapshot")
+
+    @property
+    def root(self):
+        return SnapshotFolder(self, 0)
+
+    def record(self, index) -> tuple:
+        return RECORD.unpack_from(self.mm, self.records_offset + index * RECORD.size)
+
+    def name(self, index) -> str:
+        _, _, _, _, _, name_offset, name_length = self.record(index)
+        start = self.string_table_offset + name_offset
+
+        return os.fsdecode(self.mm[start:start + name_length])
+
+    def path(self, index) -> Path:
+        names = []
+
+        while index != NO_FOLDER:
+            names.append(self.name(index))
+            index = self.record(index)[0]
+
+        return Path(*reversed(names))
+
+    def ranked_folders(self):
+        return [SnapshotFolder(self, RANKED.unpack_from(self.mm, self.ranked_offset + i * RANKED.size)[0])
+                for i in range(self.ranked_count)]
+
+    def close(self):
+        self.mm.close()
+        self.file.close()
+
+
+class SnapshotFolder:
+    __slots__ = ["snapshot", "index"]
+
+    def __init__(self, snapshot: Snapshot, index):
+        self.snapshot = snapshot
+        self.index = index
+
+    @property
+    def path(self) -> Path:
+        return self.snapshot.path(self.index)
+
+    @property
+    def name(self) -> str:
+        return self.snapshot.name(self.index)
+
+    @property
+    def parent(self):
+        parent_index = self.snapshot.record(self.index)[0]
+
+        if parent_index == NO_FOLDER:
+            return None
+        return SnapshotFolder(self.snapshot, parent_index)
+
+    @property
+    def folders(self):
+        _, first_child, child_count, _, _, _, _ = self.snapshot.record(self.index)
+
+        return [SnapshotFolder(self.snapshot, child) for child in range(first_child, first_child + child_count)]
+
+    @property
+    def folder_stats(self) -> FolderStats:
+        _, _, _, size, last_modified, _, _ = self.snapshot.record(self.index)
+
+        return FolderStats(size, last_modified)
+
+    # A snapshot never changes
+    version = 0
+
+    def top_folders(self, count) -> list:
+        """The count biggest sub folders, biggest first"""
+        _, first_child, child_count, _, _, _, _ = self.snapshot.record(self.index)
+        top_children = heapq.nlargest(count, range(first_child, first_child + child_count),
+                                      key=lambda child: self.snapshot.record(child)[3])
+
+        return [SnapshotFolder(self.snapshot, child) for child in top_children]
+
+    def find_sub_folder(self, name):
+        """Binary search, sub folders are stored sorted by name"""
+        _, first_child, child_count, _, _, _, _ = self.snapshot.record(self.index)
+        low = first_child
+        high = first_child + child_count
+
+        while low < high:
+            middle = (low + high) // 2
+            middle_name = self.snapshot.name(middle)
+
+            if middle_name == name:
+                return SnapshotFolder(self.snapshot, middle)
+            elif middle_name < name:
+                low = middle + 1
+            else:
+                high = middle
+
+        return None
+
+    def rollup(self): pass
+
+    iter_folders = Folder.iter_folders
+    __repr__ = Folder.__repr__
+
+    def __eq__(self, other):
+        return isinstance(other, SnapshotFolder) and other.snapshot is self.snapshot and other.index == self.index
+
+    def __hash__(self):
+        return hash((id(self.snapshot), self.index))
@@ -0,0 +1,43 @@
+import heapq
+import itertools
+import threading
+
+
+class TopK:
+    """
+        Keeps the k items with the smallest keys out of everything pushed so far
+        Pushing is O(log k) and memory is O(k), so it can be fed while a scan runs
+        and read at any moment. Keys must be tuples of numbers
+    """
+    def __init__(self, k, key):
+        self.k = k
+        self.key = key
+        self.lock = threading.Lock()
+        # Max heap on key, stored negated for heapq, the root is the worst item kept
+        self.heap = []
+        self.tie_breaker = itertools.count()
+
+    def push(self, item):
+        negated_key = tuple(-part for part in self.key(item))
+        entry = (negated_key, next(self.tie_breaker), item)
+
+        with self.lock:
+            if len(self.heap) < self.k:
+                heapq.heappush(self.heap, entry)
+            elif negated_key > self.heap[0][0]:
+                heapq.heapreplace(self.heap, entry)
+
+    def items(self) -> list:
+        with self.lock:
+            entries = list(self.heap)
+
+        entries.sort(key=lambda entry: entry[0], reverse=True)
+
+        return [item for _, _, item in entries]
+
+    def clear(self):
+        with self.lock:
+            self.heap = []
+
+    def __len__(self):
+        return len(self.heap)
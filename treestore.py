@@ -0,0 +1,270 @@
+import heapq
+import os
+import threading
+from array import array
+from pathlib import Path
+
+from folder import Folder, FolderStats
+
+NO_FOLDER = -1
+
+
+class TreeStore:
+    """
+        Column oriented folder tree, every folder is a row across flat arrays
+        instead of a Folder, a FolderStats, a Path and a list of its own
+        Names are interned in one string pool and full paths are only built when
+        asked for, StoredFolder is a Folder compatible view of a row
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+
+        self.parents = array("q")
+        self.first_children = array("q")
+        self.next_siblings = array("q")
+        self.sizes = array("q")
+        self.last_modified = array("d")
+        self.file_sizes = array("q")
+        self.file_last_modified = array("d")
+        self.name_offsets = array("q")
+        self.name_lengths = array("L")
+        self.dirty = bytearray()
+        self.inserted = bytearray()
+
+        self.string_pool = bytearray()
+        self.interned_names = {}
+        # Goes up whenever any size changes, rows don't get a version of their own
+        self.version = 0
+
+    def __len__(self):
+        return len(self.parents)
+
+    def _intern(self, name: str) -> (int, int):
+        encoded_name = os.fsencode(name)
+        offset = self.interned_names.get(encoded_name)
+
+        if offset is None:
+            offset = len(self.string_pool)
+            self.string_pool += encoded_name
+            self.interned_names[encoded_name] = offset
+
+        return offset, len(encoded_name)
+
+    def name(self, index) -> str:
+        offset = self.name_offsets[index]
+        return os.fsdecode(bytes(self.string_pool[offset:offset + self.name_lengths[index]]))
+
+    def path(self, index) -> Path:
+        names = []
+
+        while index != NO_FOLDER:
+            names.append(self.name(index))
+            index = self.parents[index]
+
+        return Path(*reversed(names))
+
+    def children(self, index) -> [int]:
+        children = []
+        child = self.first_children[index]
+
+        while child != NO_FOLDER:
+            children.append(child)
+            child = self.next_siblings[child]
+
+        return children
+
+    def add_folder(self, name: str, parent_index, folder_stats: FolderStats) -> int:
+        with self.lock:
+            name_offset, name_length = self._intern(name)
+
+            self.parents.append(parent_index)
+            self.first_children.append(NO_FOLDER)
+            self.next_siblings.append(NO_FOLDER)
+            self.sizes.append(folder_stats.size)
+            self.last_modified.append(folder_stats.last_modified)
+            self.file_sizes.append(folder_stats.size)
+            self.file_last_modified.append(folder_stats.last_modified)
+            self.name_offsets.append(name_offset)
+            self.name_lengths.append(name_length)
+            self.dirty.append(0)
+            self.inserted.append(0)
+
+            return len(self.parents) - 1
+
+    def make_folder(self, path: Path, parent, folder_stats: FolderStats):
+        """Same signature as the Folder constructor, so scanning code can use either"""
+        if parent is None:
+            index = self.add_folder(str(path), NO_FOLDER, folder_stats)
+        else:
+            index = self.add_folder(os.path.basename(path), parent.index, folder_stats)
+
+        return StoredFolder(self, index)
+
+    def link(self, parent_index, child_index):
+        with self.lock:
+            self.next_siblings[child_index] = self.first_children[parent_index]
+            self.first_children[parent_index] = child_index
+            self.inserted[child_index] = 1
+            self.version += 1
+
+            self._propagate(parent_index, self.sizes[child_index], self.last_modified[child_index])
+
+    def link_deferred(self, parent_index, child_index):
+        with self.lock:
+            self.next_siblings[child_index] = self.first_children[parent_index]
+            self.first_children[parent_index] = child_index
+            self.inserted[child_index] = 1
+
+        self.mark_dirty(parent_index)
+
+    def mark_dirty(self, index):
+        while index != NO_FOLDER and not self.dirty[index]:
+            self.dirty[index] = 1
+            index = self.parents[index]
+
+    def rollup(self, index):
+        """Same as Folder.rollup, over rows instead of objects"""
+        if not self.dirty[index]:
+            return
+
+        stack = [(index, False)]
+
+        while len(stack) > 0:
+            index, children_done = stack.pop()
+
+            if children_done:
+                size = self.file_sizes[index]
+                last_modified = self.file_last_modified[index]
+
+                for child in self.children(index):
+                    size += self.sizes[child]
+                    last_modified = max(last_modified, self.last_modified[child])
+
+                self.sizes[index] = size
+                self.last_modified[index] = last_modified
+                self.version += 1
+            else:
+                self.dirty[index] = 0
+                stack.append((index, True))
+
+                for child in self.children(index):
+                    if self.dirty[child]:
+                        stack.append((child, False))
+
+    def unlink(self, parent_index, child_index):
+        with self.lock:
+            if self.first_children[parent_index] == child_index:
+                self.first_children[parent_index] = self.next_siblings[child_index]
+            else:
+                sibling = self.first_children[parent_index]
+                while self.next_siblings[sibling] != child_index:
+                    sibling = self.next_siblings[sibling]
+                self.next_siblings[sibling] = self.next_siblings[child_index]
+
+            self.next_siblings[child_index] = NO_FOLDER
+            self.version += 1
+            self._propagate(parent_index, -self.sizes[child_index], 0)
+            self.parents[child_index] = NO_FOLDER
+            self.inserted[child_index] = 0
+
+    def propagate(self, index, size_delta, last_modified):
+        with self.lock:
+            self._propagate(index, size_delta, last_modified)
+
+    def _propagate(self, index, size_delta, last_modified):
+        self.version += 1
+
+        while index != NO_FOLDER:
+            self.sizes[index] += size_delta
+            self.last_modified[index] = max(self.last_modified[index], last_modified)
+
+            # Same as Folder.update_folder_stats, rows not in the tree yet stop the walk
+            if not self.inserted[index]:
+                break
+
+            index = self.parents[index]
+
+
+class StoredFolder:
+    """
+        Folder compatible view of one row in a TreeStore
+        Views are created on demand and compare equal when they point at the same row
+    """
+    __slots__ = ["store", "index"]
+
+    def __init__(self, store: TreeStore, index):
+        self.store = store
+        self.index = index
+
+    @property
+    def path(self) -> Path:
+        return self.store.path(self.index)
+
+    @property
+    def name(self) -> str:
+        return self.store.name(self.index)
+
+    @property
+    def parent(self):
+        parent_index = self.store.parents[self.index]
+
+        if parent_index == NO_FOLDER:
+            return None
+        return StoredFolder(self.store, parent_index)
+
+    @property
+    def folders(self):
+        return [StoredFolder(self.store, child) for child in self.store.children(self.index)]
+
+    @property
+    def folder_stats(self) -> FolderStats:
+        return FolderStats(self.store.sizes[self.index], self.store.last_modified[self.index])
+
+    @property
+    def file_stats(self) -> FolderStats:
+        return FolderStats(self.store.file_sizes[self.index], self.store.file_last_modified[self.index])
+
+    @property
+    def version(self) -> int:
+        return self.store.version
+
+    def top_folders(self, count) -> list:
+        """
+            The count biggest sub folders, biggest first
+            Rows don't keep a ranking, that would cost a list per folder, so
+            only the winners are picked out of the children, without sorting them
+        """
+        top_children = heapq.nlargest(count, self.store.children(self.index), key=self.store.sizes.__getitem__)
+
+        return [StoredFolder(self.store, child) for child in top_children]
+
+    def insert_folder(self, folder):
+        self.store.link(self.index, folder.index)
+
+    def insert_folder_deferred(self, folder):
+        self.store.link_deferred(self.index, folder.index)
+
+    def rollup(self):
+        self.store.rollup(self.index)
+
+    def remove_folder(self, folder):
+        self.store.unlink(self.index, folder.index)
+
+    def update_file_stats(self, file_stats: FolderStats):
+        size_delta = file_stats.size - self.store.file_sizes[self.index]
+        self.store.file_sizes[self.index] = file_stats.size
+        self.store.file_last_modified[self.index] = file_stats.last_modified
+
+        self.store.propagate(self.index, size_delta, file_stats.last_modified)
+
+    def update_folder_stats(self, leaf_node_folder_stats):
+        self.store.propagate(self.index, leaf_node_folder_stats.size, leaf_node_folder_stats.last_modified)
+
+    iter_folders = Folder.iter_folders
+    __repr__ = Folder.__repr__
+
+    def __eq__(self, other):
+        return isinstance(other, StoredFolder) and other.store is self.store and other.index == self.index
+
+    def __hash__(self):
+        return hash((id(self.store), self.index))